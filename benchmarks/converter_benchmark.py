@@ -0,0 +1,172 @@
+import argparse
+import glob
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from generate_fixtures import generate_fixtures
+
+# Throughput and peak memory of the 1_csv_converter.py stages on a fixture set (see generate_fixtures.py).
+# Every stage runs in a fresh process, so its peak RSS is not inflated by the stages before it.
+
+CONVERTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', '1_csv_converter.py')
+STAGES = ['legacy_tokenizer', 'json_legacy', 'html_fast', 'html_bs4', 'end_to_end']
+
+
+def load_converter():
+    """Import 1_csv_converter.py, whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location('csv_converter', CONVERTER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def legacy_tokenizer(converter, json_file_path):
+    """parse_nested_string_v2 on every journey split of a response, as the legacy parser does."""
+    with converter.open_artifact(json_file_path) as json_file:
+        unescaped_json = bytes(json_file.read(), "utf-8").decode("unicode_escape")
+    journeys = unescaped_json.split("[\\\"")[1:-1]
+    for journey in journeys:
+        converter.parse_nested_string_v2(journey)
+    return len(journeys)
+
+
+def run_stage(converter, stage, json_file_path, html_directory_path):
+    """Run one stage on one fixture pair and return the number of rows it produced, with the converter's CLI defaults."""
+    if stage == 'legacy_tokenizer':
+        return legacy_tokenizer(converter, json_file_path)
+    if stage == 'json_legacy':
+        return len(converter.process_json_file(json_file_path))
+
+    html_file_path = converter.find_artifact(html_directory_path, converter.artifact_base_name(json_file_path), '.html')
+    if stage == 'html_fast':
+        return 1 if converter.process_html_file(html_file_path, 'fast') else 0
+    if stage == 'html_bs4':
+        return 1 if converter.process_html_file(html_file_path, 'bs4') else 0
+    return len(converter.convert_file_pair(json_file_path, html_directory_path))
+
+
+def measure_stage(stage, json_files, html_directory_path, results):
+    """Child process body: time one stage over all files and report throughput and memory through `results`."""
+    converter = load_converter()
+    baseline_mb = max_rss_mb()
+    rows = errors = 0
+    start = time.perf_counter()
+    for json_file_path in json_files:
+        try:
+            rows += run_stage(converter, stage, json_file_path, html_directory_path)
+        except Exception:
+            errors += 1
+    seconds = time.perf_counter() - start
+    results.put({
+        'stage': stage,
+        'files': len(json_files),
+        'rows': rows,
+        'errors': errors,
+        'seconds': round(seconds, 4),
+        'files_per_second': round(len(json_files) / seconds, 2) if seconds else None,
+        'rows_per_second': round(rows / seconds, 2) if seconds else None,
+        'peak_rss_mb': round(max_rss_mb(), 1),
+        'stage_rss_mb': round(max_rss_mb() - baseline_mb, 1),
+    })
+
+
+def benchmark(stages, json_files, html_directory_path):
+    context = multiprocessing.get_context('spawn')
+    report = []
+    for stage in stages:
+        results = context.Queue()
+        process = context.Process(target=measure_stage, args=(stage, json_files, html_directory_path, results))
+        process.start()
+        report.append(results.get())
+        process.join()
+    return report
+
+
+def print_report(report):
+    header = f"{'stage':<18}{'files':>7}{'rows':>9}{'errors':>8}{'seconds':>10}{'files/s':>10}{'rows/s':>11}{'peak MB':>9}{'stage MB':>10}"
+    print(header)
+    print('-' * len(header))
+    for entry in report:
+        print(f"{entry['stage']:<18}{entry['files']:>7}{entry['rows']:>9}{entry['errors']:>8}{entry['seconds']:>10.3f}"
+              f"{entry['files_per_second'] or 0:>10.1f}{entry['rows_per_second'] or 0:>11.1f}"
+              f"{entry['peak_rss_mb']:>9.1f}{entry['stage_rss_mb']:>10.1f}")
+
+
+def compare_to_baseline(report, baseline_path, tolerance):
+    """
+    Return the stages that failed on any file, produced a different number of rows than the saved baseline
+    on the same number of files, or whose files/s dropped more than `tolerance` (a fraction) below it.
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {entry['stage']: entry for entry in json.load(f)}
+    regressions = []
+    for entry in report:
+        if entry['errors']:
+            print(f"{entry['stage']:<18}{entry['errors']} of {entry['files']} files failed")
+            regressions.append(entry['stage'])
+            continue
+        previous = baseline.get(entry['stage'])
+        if not previous:
+            continue
+        if previous['files'] == entry['files'] and previous['rows'] != entry['rows']:
+            print(f"{entry['stage']:<18}{previous['rows']} -> {entry['rows']} rows")
+            regressions.append(entry['stage'])
+            continue
+        if not previous['files_per_second'] or entry['files_per_second'] is None:
+            continue
+        change = entry['files_per_second'] / previous['files_per_second'] - 1
+        print(f"{entry['stage']:<18}{previous['files_per_second']:>10.1f} -> {entry['files_per_second']:>10.1f} files/s ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(entry['stage'])
+    return regressions
+
+
+def setup_arg_parser():
+    """Setup CLI argument parser."""
+    parser = argparse.ArgumentParser(description='Benchmark the CSV converter stages on synthetic GetShopping fixtures.')
+    parser.add_argument('--fixture_dir', default='fixtures', help='Fixture set with responses/ and html_pages/; generated if missing')
+    parser.add_argument('--files', type=int, default=100, help='Pairs to generate when the fixture set is missing (default: 100)')
+    parser.add_argument('--journeys', type=int, default=80, help='Journeys per generated response (default: 80)')
+    parser.add_argument('--html_size_kb', type=int, default=1500, help='Size of each generated HTML page, in KB (default: 1500)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages to run (default: all)')
+    parser.add_argument('--output', help='Write the results as JSON, e.g. to serve as a later baseline')
+    parser.add_argument('--baseline', help='Results JSON of an earlier run; exit non-zero if a stage got slower than --tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed files/s drop against the baseline (default: 0.2)')
+    return parser.parse_args()
+
+
+def main():
+    args = setup_arg_parser()
+    response_dir = os.path.join(args.fixture_dir, 'responses')
+    html_dir = os.path.join(args.fixture_dir, 'html_pages')
+    if not os.path.isdir(response_dir):
+        print(f"Generating {args.files} fixture pairs in {args.fixture_dir}")
+        generate_fixtures(args.fixture_dir, files=args.files, journeys=args.journeys, html_size_kb=args.html_size_kb)
+
+    json_files = sorted(glob.glob(os.path.join(response_dir, '*.json')) + glob.glob(os.path.join(response_dir, '*.json.gz')))
+    report = benchmark(args.stages, json_files, html_dir)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        regressions = compare_to_baseline(report, args.baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions (errors, row counts or throughput) in: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import gzip
+import json
+import os
+import random
+from datetime import date, timedelta
+
+# Synthetic GetShopping response / HTML page pairs in the layout the crawler writes
+# (responses/ and html_pages/ with matching base names), for benchmarking 1_csv_converter.py.
+
+COUNTRIES = {
+    "GB": ("English (United Kingdom)", "United Kingdom", "GBP"),
+    "DE": ("Deutsch", "Germany", "EUR"),
+    "US": ("English (United States)", "United States", "USD"),
+    "IN": ("English (India)", "India", "INR"),
+    "BR": ("Português (Brasil)", "Brazil", "BRL"),
+    "JP": ("日本語", "Japan", "JPY"),
+    "TR": ("Türkçe", "Türkiye", "TRY"),
+}
+AIRPORTS = ["DEN", "SFO", "ORD", "JFK", "LAX", "FRA", "LHR", "CDG", "IST", "GRU", "DEL", "HND", "DXB", "SIN"]
+AIRLINES = {"UA": "United", "LH": "Lufthansa", "BA": "British Airways", "TK": "Turkish Airlines",
+            "AF": "Air France", "EK": "Emirates", "NH": "ANA", "LA": "LATAM"}
+
+
+def setup_arg_parser():
+    """Setup CLI argument parser."""
+    parser = argparse.ArgumentParser(description='Write synthetic GetShopping response and HTML page pairs.')
+    parser.add_argument('--output_dir', required=True, help='Directory receiving responses/ and html_pages/')
+    parser.add_argument('--files', type=int, default=100, help='Number of response/HTML pairs (default: 100)')
+    parser.add_argument('--journeys', type=int, default=80, help='Journeys per response (default: 80)')
+    parser.add_argument('--max_legs', type=int, default=3, help='Maximum legs per journey (default: 3)')
+    parser.add_argument('--response_padding_kb', type=int, default=200, help='Unrelated payload added to each response, in KB (default: 200)')
+    parser.add_argument('--html_size_kb', type=int, default=1500, help='Approximate size of each HTML page, in KB (default: 1500)')
+    parser.add_argument('--compression', choices=['gzip', 'none'], default='none', help='Write *.gz artifacts like the crawler (default: none)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, so a fixture set can be regenerated exactly (default: 0)')
+    return parser.parse_args()
+
+
+def date_parts(day):
+    return [day.year, day.month, day.day]
+
+
+def make_leg(rng, departure, arrival, day, minute_of_day, duration):
+    """
+    One flight leg. At the leg's depth process_json_file reads the airports at positions 3 and 6; one level down it
+    reads the flight code as the first code/number pair, and the last leg's last five tokens as the last flight code.
+    """
+    arrival_minute = minute_of_day + duration
+    arrival_day = day + timedelta(days=arrival_minute // 1440)
+    arrival_minute %= 1440
+    airline = rng.choice(list(AIRLINES))
+    leg = [None, None, None, departure, f"{departure} International Airport", f"{arrival} International Airport", arrival,
+           None, duration, clock(minute_of_day), clock(arrival_minute), date_parts(day), date_parts(arrival_day),
+           [airline, str(rng.randint(1, 9999)), AIRLINES[airline],
+            rng.choice(["Airbus A320", "Boeing 737", "Boeing 787", "Airbus A350"]), f"{rng.randint(71, 86)} cm"]]
+    return leg, arrival_day, arrival_minute
+
+
+def clock(minute_of_day):
+    """[hour, minute], always with the minute, so the date lists read from the journey have five parts."""
+    return list(divmod(minute_of_day, 60))
+
+
+def make_itinerary(rng, departure, destination, day, max_legs):
+    """
+    [booking token, journey]. The token is JSON nested as a string, so after unicode_escape it starts with the
+    [\\" that process_json_file splits journeys on; the journey itself holds the airports, [airline, name],
+    the legs, the departure and arrival date and time (read as [Y, M, D, h, m] lists) and, last, the price.
+    """
+    stops = rng.sample([airport for airport in AIRPORTS if airport not in (departure, destination)], rng.randint(0, max_legs - 1))
+    route = [departure] + stops + [destination]
+    minute_of_day = rng.randrange(0, 1440, 5)
+    legs, leg_day, leg_minute = [], day, minute_of_day
+    for leg_departure, leg_arrival in zip(route, route[1:]):
+        leg, leg_day, leg_minute = make_leg(rng, leg_departure, leg_arrival, leg_day, leg_minute, rng.randrange(60, 720, 5))
+        legs.append(leg)
+        layover_end = leg_minute + rng.randrange(45, 240, 5)
+        leg_day += timedelta(days=layover_end // 1440)
+        leg_minute = layover_end % 1440
+
+    airline = legs[0][13][0]
+    last_leg = legs[-1]
+    duration = sum(leg[8] for leg in legs)
+    token = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789") for _ in range(120))
+    journey = [airline, departure, destination, [airline, AIRLINES[airline]], legs,
+               date_parts(day), clock(minute_of_day), last_leg[12], last_leg[10], duration, [None, rng.randint(40, 4000)]]
+    return [json.dumps([token]), journey]
+
+
+def make_response(rng, departure, destination, day, journeys, max_legs, padding_kb):
+    """
+    A GetShopping body: anti-XSSI prefix, then length-prefixed frames with the payload nested as a JSON string.
+    There is no real response in the repo, so the payload follows what process_json_file reads: journeys between
+    [\\" split points, the first and last split dropped.
+    """
+    itineraries = [make_itinerary(rng, departure, destination, day, max_legs) for _ in range(journeys)]
+    best = max(1, journeys // 5)
+    # Price graph style filler, the bulk of real responses that the converter has to skip
+    padding = [[date_parts(day + timedelta(days=offset)), [None, rng.randint(40, 4000)]]
+               for offset in range(padding_kb * 1024 // 40)]
+    # The session token closes the last journey's split
+    session = json.dumps([f"{rng.getrandbits(64):x}", departure, destination])
+    tree = [None, [departure, destination], [itineraries[:best], None], [itineraries[best:], None], session, padding]
+    frame = json.dumps([["wrb.fr", None, json.dumps(tree), None, None, None, "generic"]])
+    trailer = json.dumps([["di", rng.randint(50, 500)], ["af.httprm", rng.randint(50, 500), str(rng.getrandbits(63)), 4]])
+    return f")]}}'\n\n{len(frame)}\n{frame}\n{len(trailer)}\n{trailer}\n"
+
+
+def make_html(rng, country, size_kb):
+    """A page of filler markup with the language/country/currency spans in the footer, where Google Flights puts them."""
+    language, country_name, currency = COUNTRIES[country]
+    block = '<div class="gws-flights-results__result-item"><span class="mv1WYe">{}</span><div jsname="x{}" data-ved="{}"></div></div>'
+    filler, size = [], 0
+    while size < size_kb * 1024:
+        piece = block.format(rng.choice(AIRPORTS), rng.getrandbits(32), rng.getrandbits(64))
+        filler.append(piece)
+        size += len(piece)
+    footer = (f'<footer><div class="pxJjQe"><span class="twocKe">{language}</span></div>'
+              f'<div class="pxJjQe"><span class="twocKe">{country_name}</span></div>'
+              f'<div class="pxJjQe"><span class="twocKe">{currency}</span></div></footer>')
+    return f'<!doctype html><html><head><title>Google Flights</title></head><body>{"".join(filler)}{footer}</body></html>'
+
+
+def write_text(path, text, compress):
+    if compress:
+        with gzip.open(path + '.gz', 'wt', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def generate_fixtures(output_dir, files=100, journeys=80, max_legs=3, response_padding_kb=200, html_size_kb=1500, compress=False, seed=0):
+    """Write `files` response/HTML pairs under output_dir and return the response directory."""
+    rng = random.Random(seed)
+    response_dir = os.path.join(output_dir, 'responses')
+    html_dir = os.path.join(output_dir, 'html_pages')
+    os.makedirs(response_dir, exist_ok=True)
+    os.makedirs(html_dir, exist_ok=True)
+
+    for index in range(files):
+        country = rng.choice(list(COUNTRIES))
+        departure, destination = rng.sample(AIRPORTS, 2)
+        day = date(2024, 3, 1) + timedelta(days=rng.randint(0, 300))
+        back = day + timedelta(days=rng.randint(2, 30))
+        # The index keeps names unique when the same query is drawn twice
+        base_name = f"{country}_{departure}_to_{destination}_on_{day:%d.%m.%Y}_back_{back:%d.%m.%Y}_{index}"
+        write_text(os.path.join(response_dir, base_name + '.json'),
+                   make_response(rng, departure, destination, day, journeys, max_legs, response_padding_kb), compress)
+        write_text(os.path.join(html_dir, base_name + '.html'), make_html(rng, country, html_size_kb), compress)
+    return response_dir
+
+
+def main():
+    args = setup_arg_parser()
+    generate_fixtures(args.output_dir, args.files, args.journeys, args.max_legs, args.response_padding_kb,
+                      args.html_size_kb, args.compression == 'gzip', args.seed)
+    print(f"Wrote {args.files} response/HTML pairs to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,35 @@
 import asyncio
 import os
-from playwright.async_api import async_playwright
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from urllib.parse import quote
+import httpx
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import json
 import argparse
+import re
+import gzip
+import socket
+import sqlite3
+import threading
+import time
+
+SHOPPING_RPC_URL = "https://www.google.com/_/TravelFrontendUi/data/travel.frontend.flights.FlightsFrontendService/GetShopping"
+ANTI_XSSI_PREFIX = ")]}'"
+
+# Upper bounds in seconds for each page step; the flow moves on as soon as the step completes
+STEP_TIMEOUTS = {
+    "page_load": 30,       # initial navigation, including the consent redirect
+    "search_form": 15,     # origin combobox is visible and interactive
+    "suggestions": 5,      # airport autocomplete list after typing a code
+    "results": 40,         # GetShopping response after submitting the search
+    "results_render": 5,   # network settles after the results arrived
+}
+KEY_SETTLE_DELAY = 0.3  # Short pause for fields without an observable DOM change (date pickers, consent dialog)
+SEARCH_FORM_SELECTOR = 'input[type="text"][role="combobox"]'
+SUGGESTIONS_SELECTOR = 'ul[role="listbox"] li[role="option"]'
 
 
 def load_json_file(file_path):
@@ -15,71 +42,814 @@ def setup_arg_parser():
     """Setup CLI argument parser."""
     parser = argparse.ArgumentParser(description='Run queries with optional proxy and headers configuration.')
     parser.add_argument('--query_file', required=True, help='Path to the query JSON file')
+    parser.add_argument('--mode', choices=['browser', 'rpc'], default='browser', help="'browser' drives the Flights UI, 'rpc' replays GetShopping directly over HTTP (default: browser)")
+    parser.add_argument('--rpc_url', default=SHOPPING_RPC_URL, help='GetShopping endpoint used in rpc mode, e.g. a local stub server for testing')
+    parser.add_argument('--concurrent', action='store_true', help='Give every proxy its own query queue instead of running each query on all proxies in lockstep')
+    parser.add_argument('--per_proxy_concurrency', type=int, default=1, help='Queries run at once per proxy in concurrent mode (default: 1)')
+    parser.add_argument('--max_concurrency', type=int, default=None, help='Queries run at once across all proxies in concurrent mode (default: no global cap)')
+    parser.add_argument('--timeout', type=float, default=80, help='Seconds before a single query is abandoned (default: 80)')
+    parser.add_argument('--block_resources', action='store_true', help='Abort images, fonts, media and analytics requests in the browser flow')
+    parser.add_argument('--resource_policy', default=None, help='JSON file overriding keys of the default resource blocking policy (implies --block_resources)')
+    parser.add_argument('--max_retries', type=int, default=2, help='How often a timed out query is rescheduled on its proxy (default: 2)')
+    parser.add_argument('--failure_threshold', type=int, default=3, help='Consecutive failures after which a proxy is parked (default: 3)')
+    parser.add_argument('--base_cooldown', type=float, default=30, help='Seconds a proxy is parked after its first circuit trip; doubles with every further trip (default: 30)')
+    parser.add_argument('--max_trips', type=int, default=5, help='Circuit trips after which a proxy is retired for the rest of the run (default: 5)')
+    parser.add_argument('--compression', choices=['gzip', 'none'], default='gzip', help='Compression of saved HTML pages and responses (default: gzip)')
+    parser.add_argument('--work_queue', default=None, help='SQLite work queue shared by several executor processes; replaces --manifest and claims query/proxy leases from it')
+    parser.add_argument('--worker_id', default=f"{socket.gethostname()}-{os.getpid()}", help='Name of this worker in the work queue (default: host-pid)')
+    parser.add_argument('--lease_seconds', type=float, default=None, help='Seconds until an unfinished lease expires and is handed to another worker (default: twice --timeout)')
+    parser.add_argument('--output_dir', default='.', help='Directory receiving responses/ and html_pages/; point all workers at the same one')
+    parser.add_argument('--manifest', default=None, help='SQLite progress manifest to resume from; completed proxy/query pairs in it are skipped on restart (default: no resume)')
+    parser.add_argument('--metrics_file', default='crawl_metrics.jsonl', help='JSONL file receiving one telemetry record per finished query')
+    parser.add_argument('--prometheus_file', default='crawl_metrics.prom', help='Prometheus text snapshot of per-proxy crawl metrics')
     parser.add_argument('--proxy_file', default='../data/1.crawler_input/proxy_config.json', help='Path to the proxy configuration JSON file (optional)')
     parser.add_argument('--headers_file', default='../data/1.crawler_input/custom_headers.json', help='Path to the custom headers JSON file (optional)')
     return parser.parse_args()
 
 
 
-async def save_html(page, departure, destination, departure_date, return_date, country_id):
+async def save_html(page, departure, destination, departure_date, return_date, country_id, writer):
     filename = f"html_pages/{country_id}_{departure}_to_{destination}_on_{departure_date}_back_{return_date}.html"
-    if not os.path.exists('html_pages'):
-        os.makedirs('html_pages')
     try:
         body = await page.content()
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(body)
-        print(f"Saved HTML to {filename}")
+        saved_as = await writer.write(filename, body)
+        print(f"Saved HTML to {saved_as}")
     except Exception as e:
         print(f"Error saving HTML: {e}")
 
-async def handle_response(response, departure, destination, departure_date, return_date,country_id):
-    if response.url.startswith("https://www.google.com/_/TravelFrontendUi/data/travel.frontend.flights.FlightsFrontendService/GetShopping") and response.request.resource_type == 'xhr':
-        if not os.path.exists('responses'):
-            os.makedirs('responses')
-        filename = f'responses/{country_id}_{departure}_to_{destination}_on_{departure_date}_back_{return_date}.json'
+def is_shopping_response(response):
+    return response.url.startswith(SHOPPING_RPC_URL) and response.request.resource_type == 'xhr'
+
+
+async def save_response_body(body, departure, destination, departure_date, return_date, country_id, writer):
+    """Write a GetShopping response body to responses/, where 1_csv_converter.py picks it up."""
+    filename = f'responses/{country_id}_{departure}_to_{destination}_on_{departure_date}_back_{return_date}.json'
+    saved_as = await writer.write(filename, body)
+    print(f"Saved response to {saved_as}")
+
+
+async def handle_response(response, departure, destination, departure_date, return_date,country_id, writer, saved_event=None, trace=None):
+    if is_shopping_response(response):
+        if trace is not None:
+            trace.mark_first_response()
         try:
             body = await response.text()
-            with open(filename, 'w') as f:
-                f.write(body)
-            print(f"Saved response to {filename}")
+            await save_response_body(body, departure, destination, departure_date, return_date, country_id, writer)
+            if saved_event is not None:
+                saved_event.set()
         except Exception as e:
             print(f"Error processing response: {e}")
 
 
-async def run_query_with_multiple_proxies(departure, destination, departure_date, return_date, proxy_configs, timeout):
-    tasks = []
-    # Dictionary to map tasks to their corresponding browsers to close them on timeout
-    task_to_browser = {}
+def write_artifact(filename, text, compress):
+    """
+    Write one artifact to disk, gzip-compressed if requested. The file is written under a
+    temporary name and renamed, so readers and restarted crawls never see a partial file.
+    Returns the final filename.
+    """
+    if compress:
+        filename += ".gz"
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    # Unique per process, so workers sharing an output directory never write into each other's file
+    temp_filename = f"{filename}.{os.getpid()}.part"
+    if compress:
+        with gzip.open(temp_filename, 'wt', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            f.write(text)
+    os.replace(temp_filename, filename)
+    return filename
 
-    for proxy_config in proxy_configs:
-        browser = await launch_browser(proxy_config)  # Assumed function to launch browser
-        task = asyncio.create_task(main(departure, destination, departure_date, return_date, proxy_config, browser))
-        tasks.append(task)
-        task_to_browser[task] = browser
-
-    done, pending = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.ALL_COMPLETED)
-
-    # Attempt to close any pending tasks' browsers due to timeout
-    for task in pending:
-        print(f"Task {task} timed out. Closing browser.")
-        browser = task_to_browser[task]
-        await browser.close()  # Ensure this is a safe call if browser is already closed
-        task.cancel()
-
-    # Handle done tasks normally
-    for task in done:
-        try:
-            await task  # This will re-raise any exceptions caught within the task
-        except Exception as e:
-            print(f"Task completed with exception: {e}")
+
+class ArtifactWriter:
+    """
+    Moves artifact writes (HTML snapshots, GetShopping bodies) off the event loop.
+    Writes go through a bounded queue to a worker thread; when the queue is full,
+    producers wait, so a slow disk throttles the crawl instead of buffering pages in memory.
+    """
+
+    def __init__(self, compress=True, output_dir='.', max_pending=32):
+        self.compress = compress
+        self.output_dir = output_dir
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._worker = None
+
+    async def start(self):
+        self._worker = asyncio.create_task(self._drain())
+
+    async def write(self, filename, text):
+        """Queue an artifact and wait until it is on disk. Returns the filename it was saved as."""
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((filename, text, done))
+        return await done
+
+    async def _drain(self):
+        while True:
+            filename, text, done = await self._queue.get()
+            try:
+                saved_as = await asyncio.to_thread(write_artifact, os.path.join(self.output_dir, filename), text, self.compress)
+                if not done.done():
+                    done.set_result(saved_as)
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def close(self):
+        await self._queue.join()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+async def count_request_bytes(request, trace):
+    """Add the transferred size of a finished request to the query's trace."""
+    try:
+        sizes = await request.sizes()
+        trace.add_transfer(sizes["requestHeadersSize"] + sizes["requestBodySize"],
+                           sizes["responseHeadersSize"] + sizes["responseBodySize"])
+    except Exception:
+        pass  # The page or context may already be gone; the size is lost but the query is not affected
+
+
+async def wait_for_step(step, awaitable):
+    """
+    Wait until a page condition is met, for at most STEP_TIMEOUTS[step] seconds.
+    Returns False on timeout so the caller can decide whether to carry on.
+    """
+    try:
+        await asyncio.wait_for(awaitable, timeout=STEP_TIMEOUTS[step])
+        return True
+    except (asyncio.TimeoutError, PlaywrightTimeoutError):
+        print(f"Step '{step}' did not complete within {STEP_TIMEOUTS[step]}s, continuing")
+        return False
+
+
+def describe_query(entry):
+    return f"{entry['departure']} to {entry['destination']} on {entry['departure_date']} back {entry['return_date']}"
+
+
+async def run_single_query(entry, proxy_config, session):
+    """
+    Run one query through one proxy, bounded by the session timeout, and record the outcome
+    in the manifest, the metrics and the proxy's health. The caller must have acquired the
+    proxy through its ProxyHealth first.
+    Returns 'done', 'timeout', 'failed', or 'skipped' if the manifest already has it completed.
+    """
+    health = session.health.get(proxy_config)
+    if session.manifest is not None and await asyncio.to_thread(session.manifest.is_completed, proxy_config["country"], entry):
+        health.release()
+        return "skipped"
+    trace = session.metrics.start_query(entry, proxy_config)
+    status = await execute_query(entry, proxy_config, session, trace)
+    session.metrics.finish_query(trace, status)
+    if session.manifest is not None:
+        await asyncio.to_thread(session.manifest.record, proxy_config["country"], entry, status)
+    if health.record(status == "done"):
+        # The circuit just opened: don't keep a browser or connections open for a parked proxy
+        await session.pool.release(proxy_config)
+    return status
+
+
+async def execute_query(entry, proxy_config, session, trace):
+    try:
+        response_saved = await asyncio.wait_for(session.run_query(entry, proxy_config, session, trace), timeout=session.timeout)
+        if not response_saved:
+            print(f"Query {describe_query(entry)} via {proxy_config['country']} finished without a GetShopping response.")
+            return "failed"
+        return "done"
+    except asyncio.TimeoutError:
+        # wait_for cancels the query; its incognito context (or HTTP request) is closed on the way out,
+        # the proxy's browser or client itself stays warm in the pool for the next query.
+        print(f"Query {describe_query(entry)} via {proxy_config['country']} timed out.")
+        return "timeout"
+    except Exception as e:
+        print(f"Query {describe_query(entry)} via {proxy_config['country']} completed with exception: {e}")
+        trace.error = f"{type(e).__name__}: {e}"
+        return "failed"
+
+
+async def run_query_with_multiple_proxies(entry, proxy_configs, session):
+    tasks = [run_single_query(entry, proxy_config, session) for proxy_config in proxy_configs]
+    return await asyncio.gather(*tasks)
 
 
 
-async def run_queries_sequentially_with_multiple_proxies(queries_dataset, proxy_configs, custom_headers,timeout=80):  # Adjusted timeout as needed
+async def run_queries_sequentially_with_multiple_proxies(queries_dataset, proxy_configs, session):
+    # Queries that meet a parked proxy or time out are deferred to that proxy's own queue
+    deferred = {get_proxy_key(proxy_config): (proxy_config, asyncio.Queue()) for proxy_config in proxy_configs}
     for entry in queries_dataset:
-        await run_query_with_multiple_proxies(entry['departure'], entry['destination'], entry['departure_date'], entry['return_date'], proxy_configs, timeout)
+        available = []
+        for proxy_config in proxy_configs:
+            if session.health.get(proxy_config).try_acquire():
+                available.append(proxy_config)
+            else:
+                deferred[get_proxy_key(proxy_config)][1].put_nowait((entry, 0))
+        statuses = await run_query_with_multiple_proxies(entry, available, session)
+        for proxy_config, status in zip(available, statuses):
+            if status == "timeout" and session.max_retries > 0:
+                deferred[get_proxy_key(proxy_config)][1].put_nowait((entry, 1))
+
+    # Work off the deferred queries once their proxies are available again
+    global_limit = asyncio.Semaphore(len(proxy_configs))
+    await asyncio.gather(*(proxy_worker(proxy_config, query_queue, session, global_limit)
+                           for proxy_config, query_queue in deferred.values() if not query_queue.empty()))
+
+
+async def proxy_worker(proxy_config, query_queue, session, global_limit):
+    """
+    Drain one proxy's own queue of (entry, attempt) items. The worker waits while the
+    proxy is parked, and timed out queries go back to the end of the queue until they
+    have been retried `session.max_retries` times. The global semaphore caps queries
+    in flight across all proxies.
+    """
+    health = session.health.get(proxy_config)
+    while True:
+        try:
+            entry, attempt = query_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        if not await health.wait_until_available():
+            await park_remaining_queries(entry, query_queue, proxy_config, session)
+            return
+        async with global_limit:
+            status = await run_single_query(entry, proxy_config, session)
+        if status == "timeout" and attempt < session.max_retries:
+            print(f"Rescheduling {describe_query(entry)} via {proxy_config['country']} (retry {attempt + 1} of {session.max_retries})")
+            query_queue.put_nowait((entry, attempt + 1))
+
+
+async def park_remaining_queries(entry, query_queue, proxy_config, session):
+    """Leave the queries of a retired proxy to the next run; the manifest marks them as parked, not done."""
+    entries = [entry]
+    while not query_queue.empty():
+        entries.append(query_queue.get_nowait()[0])
+    print(f"Giving up on proxy {proxy_config['country']} for this run, {len(entries)} queries left for the next run")
+    if session.manifest is not None:
+        await asyncio.to_thread(park_entries, session.manifest, proxy_config["country"], entries)
+
+
+def park_entries(manifest, country, entries):
+    for entry in entries:
+        if not manifest.is_completed(country, entry):
+            manifest.record(country, entry, "parked")
+
+
+async def run_queries_concurrently_with_multiple_proxies(queries_dataset, proxy_configs, session, per_proxy_concurrency=1, max_concurrency=None):
+    """
+    Keep every proxy busy with its own queue of queries instead of waiting for the
+    slowest proxy after each query. Each proxy runs at most `per_proxy_concurrency`
+    queries at once and at most `max_concurrency` queries run in total (unbounded if None).
+    """
+    if max_concurrency is None:
+        max_concurrency = len(proxy_configs) * per_proxy_concurrency
+    global_limit = asyncio.Semaphore(max_concurrency)
+
+    workers = []
+    for proxy_config in proxy_configs:
+        query_queue = asyncio.Queue()
+        for entry in queries_dataset:
+            query_queue.put_nowait((entry, 0))
+        for _ in range(per_proxy_concurrency):
+            workers.append(asyncio.create_task(proxy_worker(proxy_config, query_queue, session, global_limit)))
+    await asyncio.gather(*workers)
+
+
+async def run_queries_from_work_queue(lease_store, proxy_configs, session, per_proxy_concurrency=1, max_concurrency=None):
+    """
+    Work-queue mode: claim country/query leases from a store shared with other executor
+    processes until no open work is left. Every lease loop holds at most one lease; a
+    country is only claimed while one of its proxies is healthy and below
+    `per_proxy_concurrency` queries in flight in this process.
+    """
+    if max_concurrency is None:
+        max_concurrency = len(proxy_configs) * per_proxy_concurrency
+    proxies_by_country = {}
+    for proxy_config in proxy_configs:
+        proxies_by_country.setdefault(proxy_config["country"], []).append(proxy_config)
+    in_flight = {get_proxy_key(proxy_config): 0 for proxy_config in proxy_configs}
+
+    def pick_proxy(country):
+        for proxy_config in proxies_by_country[country]:
+            if in_flight[get_proxy_key(proxy_config)] < per_proxy_concurrency and session.health.get(proxy_config).is_available():
+                return proxy_config
+        return None
+
+    async def lease_loop():
+        while True:
+            countries = [country for country in proxies_by_country if pick_proxy(country) is not None]
+            lease = await asyncio.to_thread(lease_store.claim, countries) if countries else None
+            if lease is None:
+                if not await asyncio.to_thread(lease_store.has_open_work, list(proxies_by_country)):
+                    return
+                if all(session.health.get(proxy_config).is_retired for proxy_config in proxy_configs):
+                    print("All proxies of this worker are retired, leaving the remaining work to other workers")
+                    return
+                await asyncio.sleep(lease_store.poll_interval)
+                continue
+
+            country, entry = lease
+            proxy_config = pick_proxy(country)
+            if proxy_config is None or not session.health.get(proxy_config).try_acquire():
+                await asyncio.to_thread(lease_store.give_back, country, entry)
+                continue
+            in_flight[get_proxy_key(proxy_config)] += 1
+            try:
+                await run_single_query(entry, proxy_config, session)
+            finally:
+                in_flight[get_proxy_key(proxy_config)] -= 1
+
+    await asyncio.gather(*(lease_loop() for _ in range(max_concurrency)))
+
+
+class ProxyHealth:
+    """
+    Rolling health score and circuit breaker of a single proxy.
+
+    The score is the success rate over the last `window` queries. After
+    `failure_threshold` consecutive failures the circuit opens and the proxy is
+    parked for a cooldown that doubles with every trip, up to `max_cooldown`
+    seconds. Once the cooldown has passed a single probe query is let through:
+    success closes the circuit, failure parks the proxy again for longer. After
+    `max_trips` trips in a row the proxy is retired for the rest of the run.
+    """
+
+    def __init__(self, name, window=20, failure_threshold=3, base_cooldown=30.0, max_cooldown=900.0, max_trips=5):
+        self.name = name
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.max_trips = max_trips
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def score(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+    @property
+    def is_open(self):
+        return self.trips > 0
+
+    @property
+    def is_retired(self):
+        return self.trips >= self.max_trips
+
+    def seconds_until_available(self):
+        return max(self.open_until - time.monotonic(), 0.0)
+
+    def is_available(self):
+        """True if try_acquire would currently succeed, without taking the slot."""
+        return not self.is_open or not (self.is_retired or self.probing or self.seconds_until_available() > 0)
+
+    def try_acquire(self):
+        """Return True if a query may run on this proxy now; in the half-open state only one probe may run."""
+        if not self.is_open:
+            return True
+        if self.is_retired or self.probing or self.seconds_until_available() > 0:
+            return False
+        self.probing = True
+        return True
+
+    async def wait_until_available(self):
+        """Wait while the proxy is parked. Returns False if it was retired instead."""
+        while not self.try_acquire():
+            if self.is_retired:
+                return False
+            await asyncio.sleep(max(self.seconds_until_available(), 1.0))
+        return True
+
+    def release(self):
+        """Give back an acquired slot without an outcome, e.g. for a query the manifest skipped."""
+        self.probing = False
+
+    def record(self, success):
+        """Record a query outcome. Returns True if this outcome opened (or re-opened) the circuit."""
+        self.outcomes.append(1 if success else 0)
+        if success:
+            if self.is_open:
+                print(f"Proxy {self.name} recovered, closing its circuit")
+            self.consecutive_failures = 0
+            self.trips = 0
+            self.open_until = 0.0
+            self.probing = False
+            return False
+
+        self.consecutive_failures += 1
+        if not self.probing and self.consecutive_failures < self.failure_threshold:
+            return False
+        if not self.probing and self.is_open:
+            return False  # A query that started before the circuit opened; the proxy is parked already
+        self.probing = False
+        self.trips += 1
+        if self.is_retired:
+            print(f"Proxy {self.name} retired after {self.trips} circuit trips (health score {self.score:.2f})")
+            return True
+        cooldown = min(self.base_cooldown * 2 ** (self.trips - 1), self.max_cooldown)
+        self.open_until = time.monotonic() + cooldown
+        print(f"Proxy {self.name} parked for {cooldown:.0f}s after {self.consecutive_failures} consecutive failures (health score {self.score:.2f})")
+        return True
+
+
+class ProxyHealthTracker:
+    """ProxyHealth per proxy of a crawl, created on first use."""
+
+    def __init__(self, **health_options):
+        self.health_options = health_options
+        self._health = {}
+
+    def get(self, proxy_config):
+        key = get_proxy_key(proxy_config)
+        if key not in self._health:
+            self._health[key] = ProxyHealth(f"{proxy_config['country']} ({proxy_config.get('server') or 'direct'})", **self.health_options)
+        return self._health[key]
+
+    def scores(self):
+        return {health.name: round(health.score, 2) for health in self._health.values()}
+
+
+@dataclass
+class CrawlSession:
+    """State shared by all queries of one crawl run."""
+    pool: object  # BrowserPool or RpcClientPool, depending on the crawl mode
+    run_query: object  # Coroutine function (entry, proxy_config, session, trace) -> bool, True if a response was saved
+    writer: object  # ArtifactWriter for HTML snapshots and responses
+    metrics: object  # CrawlMetrics collecting per-query and per-proxy telemetry
+    health: object  # ProxyHealthTracker deciding which proxies may take queries
+    timeout: float = 80
+    manifest: object = None  # CrawlManifest, or None to crawl without resume support
+    max_retries: int = 2  # How often a timed out query is rescheduled on its proxy
+    resource_policy: object = None  # ResourcePolicy for the browser flow, or None to load pages in full
+
+
+@asynccontextmanager
+async def open_crawl_session(mode, timeout, per_proxy_concurrency=1, rpc_url=SHOPPING_RPC_URL, manifest=None, compress=True, metrics=None,
+                             health=None, max_retries=2, resource_policy=None, output_dir='.'):
+    """Start the connection pool of the chosen crawl mode ('browser' or 'rpc') and close it afterwards."""
+    writer = ArtifactWriter(compress, output_dir)
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    health = health if health is not None else ProxyHealthTracker()
+    if mode == "rpc":
+        session = CrawlSession(RpcClientPool(max_connections=per_proxy_concurrency, rpc_url=rpc_url), run_rpc_query, writer, metrics, health, timeout, manifest, max_retries)
+    elif mode == "browser":
+        session = CrawlSession(BrowserPool(), run_browser_query, writer, metrics, health, timeout, manifest, max_retries, resource_policy)
+    else:
+        raise ValueError("Invalid crawl mode specified. Choose 'browser' or 'rpc'.")
+    await session.writer.start()
+    await session.pool.start()
+    try:
+        yield session
+    finally:
+        await session.pool.close()
+        await session.writer.close()
+
+
+async def run_crawl(args, queries_dataset, proxy_configs, manifest, metrics):
+    health = ProxyHealthTracker(failure_threshold=args.failure_threshold, base_cooldown=args.base_cooldown, max_trips=args.max_trips)
+    resource_policy = ResourcePolicy.from_file(args.resource_policy) if args.block_resources or args.resource_policy else None
+    async with open_crawl_session(args.mode, args.timeout, args.per_proxy_concurrency, args.rpc_url, manifest,
+                                  args.compression == 'gzip', metrics, health, args.max_retries, resource_policy,
+                                  args.output_dir) as session:
+        if args.work_queue:
+            await run_queries_from_work_queue(manifest, proxy_configs, session, args.per_proxy_concurrency, args.max_concurrency)
+        elif args.concurrent:
+            await run_queries_concurrently_with_multiple_proxies(queries_dataset, proxy_configs, session,
+                                                                 args.per_proxy_concurrency, args.max_concurrency)
+        else:
+            await run_queries_sequentially_with_multiple_proxies(queries_dataset, proxy_configs, session)
+    print(f"Proxy health scores: {health.scores()}")
+
+
+@dataclass
+class QueryTrace:
+    """Telemetry of a single proxy/query run, filled in while the query executes."""
+    country: str
+    proxy: str
+    query: str
+    started_at: float = field(default_factory=time.monotonic)
+    first_response_at: float = None
+    bytes_received: int = 0
+    bytes_sent: int = 0
+    blocked_requests: int = 0
+    bytes_saved_estimate: int = 0
+    redirected: bool = False
+    error: str = None
+
+    def mark_first_response(self):
+        if self.first_response_at is None:
+            self.first_response_at = time.monotonic()
+
+    def add_transfer(self, sent, received):
+        self.bytes_sent += max(sent, 0)
+        self.bytes_received += max(received, 0)
+
+
+class CrawlMetrics:
+    """
+    Per-query and per-proxy crawl telemetry. Every finished query is appended as one
+    JSON line to `jsonl_path`; per-proxy totals are written as a Prometheus text
+    snapshot to `prometheus_path`. Either path may be None to skip that output.
+    """
 
+    SNAPSHOT_EVERY = 10  # queries between Prometheus snapshots; a final one is written on close
+
+    def __init__(self, jsonl_path=None, prometheus_path=None):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._jsonl = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+        self._proxies = {}
+        self._finished = 0
+
+    def start_query(self, entry, proxy_config):
+        return QueryTrace(country=proxy_config["country"], proxy=proxy_config.get("server") or "direct", query=describe_query(entry))
+
+    def finish_query(self, trace, status):
+        total_seconds = time.monotonic() - trace.started_at
+        first_response_seconds = None if trace.first_response_at is None else trace.first_response_at - trace.started_at
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "country": trace.country,
+            "proxy": trace.proxy,
+            "query": trace.query,
+            "status": status,
+            "total_seconds": round(total_seconds, 3),
+            "first_response_seconds": None if first_response_seconds is None else round(first_response_seconds, 3),
+            "bytes_received": trace.bytes_received,
+            "bytes_sent": trace.bytes_sent,
+            "blocked_requests": trace.blocked_requests,
+            "bytes_saved_estimate": trace.bytes_saved_estimate,
+            "redirected": trace.redirected,
+            "error": trace.error,
+        }
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(record) + "\n")
+            self._jsonl.flush()
+
+        stats = self._proxies.setdefault((trace.country, trace.proxy), {
+            "statuses": {}, "duration_sum": 0.0, "first_response_sum": 0.0, "first_response_count": 0,
+            "bytes_received": 0, "bytes_sent": 0, "blocked_requests": 0, "bytes_saved_estimate": 0, "redirects": 0, "exceptions": 0,
+        })
+        stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+        stats["duration_sum"] += total_seconds
+        if first_response_seconds is not None:
+            stats["first_response_sum"] += first_response_seconds
+            stats["first_response_count"] += 1
+        stats["bytes_received"] += trace.bytes_received
+        stats["bytes_sent"] += trace.bytes_sent
+        stats["blocked_requests"] += trace.blocked_requests
+        stats["bytes_saved_estimate"] += trace.bytes_saved_estimate
+        stats["redirects"] += int(trace.redirected)
+        stats["exceptions"] += int(trace.error is not None)
+
+        self._finished += 1
+        if self._finished % self.SNAPSHOT_EVERY == 0:
+            self.write_prometheus_snapshot()
+
+    def prometheus_text(self):
+        families = [
+            ("skysaver_queries_total", "counter", "Finished queries by outcome."),
+            ("skysaver_query_duration_seconds", "summary", "Wall time of finished queries."),
+            ("skysaver_first_response_seconds", "summary", "Time from query start to the first GetShopping response."),
+            ("skysaver_bytes_received_total", "counter", "Bytes received through the proxy."),
+            ("skysaver_bytes_sent_total", "counter", "Bytes sent through the proxy."),
+            ("skysaver_blocked_requests_total", "counter", "Requests aborted by the resource blocking policy."),
+            ("skysaver_bytes_saved_estimated_total", "counter", "Estimated bytes the resource blocking policy kept off the proxy."),
+            ("skysaver_redirects_total", "counter", "Queries that were redirected, e.g. to the consent page."),
+            ("skysaver_exceptions_total", "counter", "Queries that ended with an exception."),
+        ]
+        samples = {name: [] for name, _, _ in families}
+        for (country, proxy), stats in sorted(self._proxies.items()):
+            labels = f'country="{country}",proxy="{proxy}"'
+            for status, count in sorted(stats["statuses"].items()):
+                samples["skysaver_queries_total"].append(("", f'{labels},status="{status}"', count))
+            samples["skysaver_query_duration_seconds"] += [("_sum", labels, round(stats["duration_sum"], 3)),
+                                                          ("_count", labels, sum(stats["statuses"].values()))]
+            samples["skysaver_first_response_seconds"] += [("_sum", labels, round(stats["first_response_sum"], 3)),
+                                                          ("_count", labels, stats["first_response_count"])]
+            samples["skysaver_bytes_received_total"].append(("", labels, stats["bytes_received"]))
+            samples["skysaver_bytes_sent_total"].append(("", labels, stats["bytes_sent"]))
+            samples["skysaver_blocked_requests_total"].append(("", labels, stats["blocked_requests"]))
+            samples["skysaver_bytes_saved_estimated_total"].append(("", labels, stats["bytes_saved_estimate"]))
+            samples["skysaver_redirects_total"].append(("", labels, stats["redirects"]))
+            samples["skysaver_exceptions_total"].append(("", labels, stats["exceptions"]))
+
+        lines = []
+        for name, metric_type, help_text in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{name}{suffix}{{{labels}}} {value}" for suffix, labels, value in samples[name])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_snapshot(self):
+        if not self.prometheus_path:
+            return
+        temp_path = f"{self.prometheus_path}.part"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.prometheus_path)
+
+    def print_summary(self):
+        for (country, proxy), stats in sorted(self._proxies.items()):
+            finished = sum(stats["statuses"].values())
+            first_response = stats["first_response_sum"] / stats["first_response_count"] if stats["first_response_count"] else float('nan')
+            print(f"{country} via {proxy}: {finished} queries {stats['statuses']}, "
+                  f"avg {stats['duration_sum'] / finished:.1f}s total, avg {first_response:.1f}s to first response, "
+                  f"{stats['bytes_received'] / 1e6:.1f} MB received, ~{stats['bytes_saved_estimate'] / 1e6:.1f} MB saved by blocking")
+
+    def close(self):
+        self.write_prometheus_snapshot()
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
+
+
+
+class CrawlManifest:
+    """
+    Crash-safe progress record of a crawl in SQLite, keyed by country and the
+    departure/destination/date tuple. Every outcome is committed as soon as the
+    query ends, so a restarted crawl skips completed pairs and retries only the
+    failed or timed out ones. The crawl calls it from worker threads, so the
+    connection is shared under a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS progress (
+                country TEXT NOT NULL,
+                departure TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                departure_date TEXT NOT NULL,
+                return_date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (country, departure, destination, departure_date, return_date)
+            )""")
+        self.connection.commit()
+
+    @staticmethod
+    def key(country, entry):
+        return (country, entry['departure'], entry['destination'], entry['departure_date'], entry['return_date'])
+
+    def is_completed(self, country, entry):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT status FROM progress WHERE country = ? AND departure = ? AND destination = ? AND departure_date = ? AND return_date = ?",
+                self.key(country, entry)).fetchone()
+        return row is not None and row[0] == "done"
+
+    def record(self, country, entry, status):
+        with self._lock:
+            self.connection.execute("""
+                INSERT INTO progress (country, departure, destination, departure_date, return_date, status, attempts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (country, departure, destination, departure_date, return_date)
+                DO UPDATE SET status = excluded.status, attempts = attempts + 1, updated_at = excluded.updated_at""",
+                (*self.key(country, entry), status, datetime.now().isoformat(timespec="seconds")))
+            self.connection.commit()
+
+    def summary(self):
+        """Count recorded pairs per status."""
+        with self._lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM progress GROUP BY status").fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+class LeaseStore:
+    """
+    Shared work queue of country/query pairs in SQLite for several executor processes,
+    on one box or on several boxes sharing a filesystem with working file locks.
+
+    Workers claim a pair by taking a lease that expires after `lease_seconds`; if a
+    worker dies, its lease runs out and another worker picks the pair up. Failed or
+    timed out pairs go back to the queue until they have been tried `max_attempts`
+    times. The store offers the same is_completed/record/summary interface as
+    CrawlManifest, so it doubles as the crawl's progress record.
+    """
+
+    poll_interval = 5.0  # seconds between claims while all open work is leased by other workers
+
+    def __init__(self, path, worker_id, lease_seconds, max_attempts=3):
+        self.path = path
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                country TEXT NOT NULL,
+                departure TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                departure_date TEXT NOT NULL,
+                return_date TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                lease_expires REAL,
+                updated_at TEXT,
+                PRIMARY KEY (country, departure, destination, departure_date, return_date)
+            )""")
+
+    key = staticmethod(CrawlManifest.key)
+
+    def seed(self, queries_dataset, proxy_configs):
+        """Add every country/query pair that is not in the queue yet; safe to run from every worker."""
+        countries = sorted({proxy_config["country"] for proxy_config in proxy_configs})
+        rows = [self.key(country, entry) for country in countries for entry in queries_dataset]
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany("""
+                INSERT OR IGNORE INTO leases (country, departure, destination, departure_date, return_date)
+                VALUES (?, ?, ?, ?, ?)""", rows)
+            self.connection.execute("COMMIT")
+
+    def claim(self, countries):
+        """Lease the next open pair for one of `countries`. Returns (country, entry) or None."""
+        if not countries:
+            return None
+        now = time.time()
+        placeholders = ",".join("?" * len(countries))
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(f"""
+                    SELECT rowid, country, departure, destination, departure_date, return_date FROM leases
+                    WHERE country IN ({placeholders})
+                      AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                    ORDER BY attempts, rowid LIMIT 1""", (*countries, now)).fetchone()
+                if row is not None:
+                    self.connection.execute("""
+                        UPDATE leases SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                        WHERE rowid = ?""", (self.worker_id, now + self.lease_seconds, datetime.now().isoformat(timespec="seconds"), row[0]))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        _, country, departure, destination, departure_date, return_date = row
+        return country, {"departure": departure, "destination": destination, "departure_date": departure_date, "return_date": return_date}
+
+    def give_back(self, country, entry):
+        """Return a claimed pair untouched, e.g. because its proxy became unavailable meanwhile."""
+        with self._lock:
+            self.connection.execute("""
+                UPDATE leases SET status = 'pending', worker_id = NULL, lease_expires = NULL, attempts = attempts - 1
+                WHERE country = ? AND departure = ? AND destination = ? AND departure_date = ? AND return_date = ? AND worker_id = ?""",
+                (*self.key(country, entry), self.worker_id))
+
+    def has_open_work(self, countries):
+        """True while any pair for `countries` is pending or leased by some worker."""
+        placeholders = ",".join("?" * len(countries))
+        with self._lock:
+            row = self.connection.execute(f"""
+                SELECT 1 FROM leases WHERE country IN ({placeholders}) AND status IN ('pending', 'leased') LIMIT 1""",
+                countries).fetchone()
+        return row is not None
+
+    def is_completed(self, country, entry):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT status FROM leases WHERE country = ? AND departure = ? AND destination = ? AND departure_date = ? AND return_date = ?",
+                self.key(country, entry)).fetchone()
+        return row is not None and row[0] == "done"
+
+    def record(self, country, entry, status):
+        """Finish this worker's lease: done pairs are closed, others are re-queued until max_attempts is reached."""
+        with self._lock:
+            self.connection.execute("""
+                UPDATE leases
+                SET status = CASE WHEN ? = 'done' THEN 'done' WHEN attempts >= ? THEN ? ELSE 'pending' END,
+                    worker_id = NULL, lease_expires = NULL, updated_at = ?
+                WHERE country = ? AND departure = ? AND destination = ? AND departure_date = ? AND return_date = ?
+                  AND worker_id = ?""",
+                (status, self.max_attempts, status, datetime.now().isoformat(timespec="seconds"), *self.key(country, entry), self.worker_id))
+
+    def summary(self):
+        with self._lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM leases GROUP BY status").fetchall())
+
+    def close(self):
+        """Hand back leases this worker still holds, so other workers don't wait for them to expire."""
+        with self._lock:
+            self.connection.execute("""
+                UPDATE leases SET status = 'pending', worker_id = NULL, lease_expires = NULL
+                WHERE status = 'leased' AND worker_id = ?""", (self.worker_id,))
+            self.connection.close()
 
 
 async def is_browser_alive(browser):
@@ -93,111 +863,358 @@ async def is_browser_alive(browser):
         return False
 
 
-async def launch_browser(proxy_config):
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(proxy={
-            "server": proxy_config["server"],
-            "username": proxy_config["username"],
-            "password": proxy_config["password"]
-        }, headless=False)
+async def launch_browser(playwright, proxy_config, headless=False):
+    browser = await playwright.chromium.launch(proxy={
+        "server": proxy_config["server"],
+        "username": proxy_config["username"],
+        "password": proxy_config["password"]
+    }, headless=headless)
     return browser
 
 
+def get_proxy_key(proxy_config):
+    """Identify a proxy entry; several entries may share a server and differ only in credentials."""
+    return (proxy_config.get("server"), proxy_config.get("username"), proxy_config["country"])
+
+
+class BrowserPool:
+    """
+    Long-lived browsers for the whole crawl: one Playwright driver and one warm
+    Chromium per proxy. Every query gets its own fresh incognito context.
+    """
+
+    def __init__(self, headless=False):
+        self.headless = headless
+        self._playwright = None
+        self._browsers = {}
+        self._launch_locks = {}
+
+    async def start(self):
+        self._playwright = await async_playwright().start()
+
+    async def get_browser(self, proxy_config):
+        """Return the warm browser for this proxy, (re)launching it if it is missing or has died."""
+        key = get_proxy_key(proxy_config)
+        lock = self._launch_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            browser = self._browsers.get(key)
+            if browser is None or not browser.is_connected():
+                print(f"Launching Browser for {proxy_config['country']}...")
+                browser = await launch_browser(self._playwright, proxy_config, self.headless)
+                self._browsers[key] = browser
+            return browser
+
+    @asynccontextmanager
+    async def incognito_context(self, proxy_config, headers):
+        """Hand out a fresh incognito context on the proxy's browser and close it afterwards."""
+        browser = await self.get_browser(proxy_config)
+        context = await browser.new_context(
+            user_agent=headers["User-Agent"],  # This sets the user agent
+            extra_http_headers={k: v for k, v in headers.items() if k != "User-Agent"}  # This sets all other headers except the user agent
+        )
+        try:
+            yield context
+        finally:
+            try:
+                await context.close()
+            except Exception as e:
+                print(f"Error closing browser context: {e}")
+
+    async def release(self, proxy_config):
+        """Close the browser of a single proxy; it is relaunched on the next request."""
+        browser = self._browsers.pop(get_proxy_key(proxy_config), None)
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception as e:
+                print(f"Error closing browser: {e}")
+
+    async def close(self):
+        for browser in self._browsers.values():
+            try:
+                await browser.close()
+            except Exception as e:
+                print(f"Error closing browser: {e}")
+        self._browsers.clear()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+
+
+
+
+DEFAULT_RESOURCE_POLICY = {
+    # Resource types the search flow does not need
+    "blocked_resource_types": ["image", "media", "font"],
+    # Analytics and logging endpoints, blocked whatever their resource type
+    "blocked_url_patterns": [r"google-analytics\.com", r"googletagmanager\.com", r"doubleclick\.net", r"/gen_204", r"/log\?", r"/_/TravelFrontendUi/jserror"],
+    # Never blocked: the GetShopping XHR and the flights document carrying the twocKe metadata spans
+    "allowed_url_patterns": [r"FlightsFrontendService/GetShopping", r"^https://www\.google\.com/travel/flights"],
+    # Typical transfer size per blocked request, used to estimate the bytes kept off the proxy
+    "estimated_bytes": {"image": 20000, "media": 250000, "font": 35000, "stylesheet": 25000, "script": 60000, "default": 2000},
+}
+
+
+class ResourcePolicy:
+    """
+    Opt-in request blocking for the browser flow. Requests are aborted by resource type
+    or URL pattern unless they match the allowlist; every blocked request is counted on
+    the query's trace together with an estimate of the bytes it would have transferred.
+    """
+
+    def __init__(self, blocked_resource_types, blocked_url_patterns, allowed_url_patterns, estimated_bytes):
+        self.blocked_resource_types = set(blocked_resource_types)
+        self.blocked_url_patterns = [re.compile(pattern) for pattern in blocked_url_patterns]
+        self.allowed_url_patterns = [re.compile(pattern) for pattern in allowed_url_patterns]
+        self.estimated_bytes = estimated_bytes
+
+    @classmethod
+    def from_file(cls, file_path=None):
+        """Build a policy from DEFAULT_RESOURCE_POLICY, with keys overridden by an optional JSON file."""
+        options = dict(DEFAULT_RESOURCE_POLICY)
+        if file_path:
+            options.update(load_json_file(file_path))
+        return cls(**options)
+
+    def should_block(self, request):
+        url = request.url
+        if any(pattern.search(url) for pattern in self.allowed_url_patterns):
+            return False
+        return request.resource_type in self.blocked_resource_types or any(pattern.search(url) for pattern in self.blocked_url_patterns)
+
+    async def apply(self, context, trace):
+        """Route every request of the context through the policy."""
+        async def handle_route(route):
+            request = route.request
+            if self.should_block(request):
+                trace.blocked_requests += 1
+                trace.bytes_saved_estimate += self.estimated_bytes.get(request.resource_type, self.estimated_bytes.get("default", 0))
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await context.route("**/*", handle_route)
+
+
+def get_headers(country_id):
+    return custom_headers.get(country_id, {"Accept-Language": "en-US,en;q=0.9", "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.60 Safari/537.36"})
+
+
+def build_proxy_url(proxy_config):
+    """Turn a proxy_config.json entry into a proxy URL with credentials for the HTTP client."""
+    scheme, _, host = proxy_config["server"].rpartition("://")
+    credentials = f"{quote(proxy_config['username'], safe='')}:{quote(proxy_config['password'], safe='')}"
+    return f"{scheme or 'http'}://{credentials}@{host}"
+
+
+def to_iso_date(date):
+    """Query files use DD.MM.YYYY, the RPC expects YYYY-MM-DD."""
+    return datetime.strptime(date, "%d.%m.%Y").strftime("%Y-%m-%d")
+
+
+def build_shopping_request(entry):
+    """
+    Build the form body of a round-trip GetShopping call, mirroring the request the
+    Flights UI sends when the search form is submitted (economy, one adult).
+    """
+    def leg(origin, destination, date):
+        return [[[[origin, 0]]], [[[destination, 0]]], None, 0, None, None, date, None, None, None, None, None, None, None, 3]
 
+    search = [[], [None, None, 1, None, [], 1, [1, 0, 0, 0], None, None, None, None, None, None,
+                   [leg(entry['departure'], entry['destination'], to_iso_date(entry['departure_date'])),
+                    leg(entry['destination'], entry['departure'], to_iso_date(entry['return_date']))],
+                   None, None, None, 1], 0, 0, 0, 1]
+    return {"f.req": json.dumps([None, json.dumps(search, separators=(',', ':'))], separators=(',', ':'))}
 
 
+# RPC mode has no page to read the language/country/currency footer from. The currency is pinned in the request
+# and the metadata written next to the response; a proxy entry can override the defaults with "language_name",
+# "country_name" and "currency". The defaults are the hl code and the English country name, not the footer's
+# localized labels, so they only match browser-crawled rows if the proxy entry sets the footer's texts.
+RPC_COUNTRY_DEFAULTS = {
+    "AE": ("United Arab Emirates", "AED"), "AL": ("Albania", "ALL"), "AM": ("Armenia", "AMD"), "AU": ("Australia", "AUD"),
+    "AZ": ("Azerbaijan", "AZN"), "BA": ("Bosnia and Herzegovina", "BAM"), "BD": ("Bangladesh", "BDT"), "BE": ("Belgium", "EUR"),
+    "BG": ("Bulgaria", "BGN"), "BJ": ("Benin", "XOF"), "BR": ("Brazil", "BRL"), "BY": ("Belarus", "BYN"),
+    "CH": ("Switzerland", "CHF"), "CY": ("Cyprus", "EUR"), "CZ": ("Czech Republic", "CZK"), "DE": ("Germany", "EUR"),
+    "DK": ("Denmark", "DKK"), "DZ": ("Algeria", "DZD"), "EG": ("Egypt", "EGP"), "ES": ("Spain", "EUR"),
+    "FR": ("France", "EUR"), "GB": ("United Kingdom", "GBP"), "GR": ("Greece", "EUR"), "ID": ("Indonesia", "IDR"),
+    "IN": ("India", "INR"), "IR": ("Iran", "IRR"), "JP": ("Japan", "JPY"), "KW": ("Kuwait", "KWD"),
+    "LB": ("Lebanon", "LBP"), "LT": ("Lithuania", "EUR"), "LY": ("Libya", "LYD"), "MA": ("Morocco", "MAD"),
+    "NL": ("Netherlands", "EUR"), "NO": ("Norway", "NOK"), "OM": ("Oman", "OMR"), "PK": ("Pakistan", "PKR"),
+    "PL": ("Poland", "PLN"), "PS": ("Palestine", "ILS"), "PT": ("Portugal", "EUR"), "RO": ("Romania", "RON"),
+    "RU": ("Russia", "RUB"), "SA": ("Saudi Arabia", "SAR"), "SE": ("Sweden", "SEK"), "TR": ("Turkey", "TRY"),
+    "UA": ("Ukraine", "UAH"), "US": ("United States", "USD"), "ZA": ("South Africa", "ZAR"),
+}
 
-async def main(departure, destination, departure_date, return_date, proxy_config, browser):
+
+def rpc_page_metadata(proxy_config, language):
+    """
+    The Detected_* values standing in for the page footer of an RPC query through proxy_config.
+    "Metadata_Source" records that they come from the proxy entry and RPC_COUNTRY_DEFAULTS, not from a page.
+    """
     country_id = proxy_config["country"]
-    headers = custom_headers.get(country_id, {"Accept-Language": "en-US,en;q=0.9", "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.60 Safari/537.36"})
+    country_name, currency = RPC_COUNTRY_DEFAULTS.get(country_id, (country_id, None))
+    return {
+        "Detected_Language": proxy_config.get("language_name", language),
+        "Detected_Country": proxy_config.get("country_name", country_name),
+        "Detected_Currency": proxy_config.get("currency", currency),
+        "Metadata_Source": "rpc",
+    }
 
 
-    async with async_playwright() as p:
-        print('Launching Browser...')
+async def save_page_metadata(metadata, departure, destination, departure_date, return_date, country_id, writer):
+    """Write the page metadata of an RPC query to html_pages/, where the converter uses it in place of a missing page."""
+    filename = f"html_pages/{country_id}_{departure}_to_{destination}_on_{departure_date}_back_{return_date}.meta.json"
+    saved_as = await writer.write(filename, json.dumps(metadata, ensure_ascii=False))
+    print(f"Saved page metadata to {saved_as}")
 
-        browser = await p.chromium.launch(proxy={
-            "server": proxy_config["server"],
-            "username": proxy_config["username"],
-            "password": proxy_config["password"]
-        }, headless=False)
 
+class RpcClientPool:
+    """
+    One pooled HTTP client per proxy for the direct-RPC crawl mode. Connections are kept
+    alive between queries and every client carries the per-country headers.
+    """
 
-        print("Creating incognito browser context with custom user agent")
-        headers = custom_headers.get(country_id, {
-        "User-Agent": "Default-User-Agent",
-        "Accept-Language": "en-US,en;q=0.9"
-    })
+    def __init__(self, max_connections=1, rpc_url=SHOPPING_RPC_URL):
+        self.max_connections = max_connections
+        self.rpc_url = rpc_url
+        self._clients = {}
 
-        # Create the context with the specific headers for the country
-        context = await browser.new_context(
-            user_agent=headers["User-Agent"],  # This sets the user agent
-            extra_http_headers={k: v for k, v in headers.items() if k != "User-Agent"}  # This sets all other headers except the user agent
-    )
+    async def start(self):
+        pass
+
+    def get_client(self, proxy_config):
+        key = get_proxy_key(proxy_config)
+        client = self._clients.get(key)
+        if client is None:
+            headers = get_headers(proxy_config["country"])
+            client = httpx.AsyncClient(
+                # Entries without a server go out directly, e.g. against a local stub server
+                proxy=build_proxy_url(proxy_config) if proxy_config.get("server") else None,
+                headers={**headers, "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8"},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(30.0),
+            )
+            self._clients[key] = client
+        return client
+
+    async def release(self, proxy_config):
+        client = self._clients.pop(get_proxy_key(proxy_config), None)
+        if client is not None:
+            await client.aclose()
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+async def run_rpc_query(entry, proxy_config, session, trace):
+    """Replay GetShopping for one query in a single HTTP round trip and save the body like the browser flow does."""
+    country_id = proxy_config["country"]
+    rpc_pool = session.pool
+    client = rpc_pool.get_client(proxy_config)
+    language = get_headers(country_id).get("Accept-Language", "en-US").split(",")[0]
+    metadata = rpc_page_metadata(proxy_config, language)
+    params = {"hl": language, "gl": country_id, "rt": "c"}
+    if metadata["Detected_Currency"]:
+        params["curr"] = metadata["Detected_Currency"]
+    else:
+        print(f"No currency known for {country_id}; add \"currency\" to its proxy entry so prices can be converted")
+    request_body = build_shopping_request(entry)
+    response = await client.post(rpc_pool.rpc_url, params=params, data=request_body)
+    trace.mark_first_response()
+    trace.redirected = bool(response.history)
+    sent = len(str(response.request.url)) + sum(len(k) + len(v) for k, v in response.request.headers.raw) + len(response.request.content)
+    received = sum(len(k) + len(v) for k, v in response.headers.raw) + response.num_bytes_downloaded
+    trace.add_transfer(sent, received)
+    body = response.text
+    if response.status_code != 200 or not body.startswith(ANTI_XSSI_PREFIX):
+        print(f"Unexpected GetShopping reply for {describe_query(entry)} via {country_id}: HTTP {response.status_code}")
+        return False
+    await save_response_body(body, entry['departure'], entry['destination'], entry['departure_date'], entry['return_date'], country_id, session.writer)
+    await save_page_metadata(metadata, entry['departure'], entry['destination'], entry['departure_date'], entry['return_date'], country_id, session.writer)
+    return True
 
+
+async def run_browser_query(entry, proxy_config, session, trace):
+    return await main(entry['departure'], entry['destination'], entry['departure_date'], entry['return_date'], proxy_config, session, trace)
+
+
+async def main(departure, destination, departure_date, return_date, proxy_config, session, trace):
+    country_id = proxy_config["country"]
+    headers = get_headers(country_id)
+
+    print("Creating incognito browser context with custom user agent")
+    # The context carries the specific headers for the country; the browser behind it stays warm in the pool
+    async with session.pool.incognito_context(proxy_config, headers) as context:
+        if session.resource_policy is not None:
+            await session.resource_policy.apply(context, trace)
         # Open a new page within the configured context
         print("Opening a new page")
         page = await context.new_page()
 
-        page.on('response', lambda response: asyncio.create_task(handle_response(response, departure, destination, departure_date, return_date, country_id)))
-
+        # Every captured GetShopping response is saved by its own task; the event tells the flow it has arrived
+        shopping_saved = asyncio.Event()
+        response_tasks = []
+        page.on('response', lambda response: response_tasks.append(asyncio.create_task(handle_response(response, departure, destination, departure_date, return_date, country_id, session.writer, shopping_saved, trace))))
+        page.on('requestfinished', lambda request: response_tasks.append(asyncio.create_task(count_request_bytes(request, trace))))
 
         initial_url = "https://www.google.com/travel/flights"
-        await page.goto(initial_url, wait_until="networkidle")
-        await page.wait_for_timeout(10)  # Wait for potential redirects
+        await page.goto(initial_url, wait_until="domcontentloaded", timeout=STEP_TIMEOUTS["page_load"] * 1000)
 
         # Corrected logic for handling redirects; adjust as necessary.
         current_url = page.url
         if current_url != initial_url:
             print("Handling redirection with keyboard inputs...")
+            trace.redirected = True
             for _ in range(3):  # Example logic; adjust based on actual page behavior.
                 await page.keyboard.press('Tab')
-                await asyncio.sleep(1)  # Adjust timing as necessary.
+                await asyncio.sleep(KEY_SETTLE_DELAY)
             await page.keyboard.press('Enter')
+            await wait_for_step("page_load", page.wait_for_url(f"{initial_url}**"))
         else:
             print("No redirection, proceeding with the original workflow")
-        
-        await asyncio.sleep(5)
-        await save_html(page, departure, destination, departure_date, return_date,country_id)
-        print("Waiting")
-        await asyncio.sleep(2)
-        await page.click('input[type="text"][role="combobox"]')
+
+        await wait_for_step("search_form", page.wait_for_selector(SEARCH_FORM_SELECTOR, state="visible"))
+        await save_html(page, departure, destination, departure_date, return_date,country_id, session.writer)
+        await page.click(SEARCH_FORM_SELECTOR)
         print("clicked")
         await page.keyboard.down('Meta')
         await page.keyboard.press('A')
         await page.keyboard.up('Meta')
         await page.keyboard.press('Backspace')
         await page.keyboard.type(departure)
-        await asyncio.sleep(3)
+        await wait_for_step("suggestions", page.wait_for_selector(SUGGESTIONS_SELECTOR, state="visible"))
         await page.keyboard.press('Tab')
-        await asyncio.sleep(3)
         await page.keyboard.press('Tab')
-        await asyncio.sleep(2)
         # Simulate typing 'New York' into the destination field and pressing Enter
         await page.keyboard.type(destination)
-        await asyncio.sleep(3)
+        await wait_for_step("suggestions", page.wait_for_selector(SUGGESTIONS_SELECTOR, state="visible"))
         await page.keyboard.press('Tab')
         await page.keyboard.press('Tab')
-        await asyncio.sleep(2)
         # Simulate typing the departure date and pressing Tab
         await page.keyboard.type(departure_date)
-        await asyncio.sleep(2)
+        await asyncio.sleep(KEY_SETTLE_DELAY)
         await page.keyboard.press('Tab')
-
-        await asyncio.sleep(3)
         # Simulate typing the return date and pressing Enter
         await page.keyboard.type(return_date)
-        await asyncio.sleep(3)
+        await asyncio.sleep(KEY_SETTLE_DELAY)
         await page.keyboard.press('Enter')
         await page.keyboard.press('Enter')
-
-        # Wait for a moment to see the result
-        await asyncio.sleep(2)
+        await asyncio.sleep(KEY_SETTLE_DELAY)
         await page.keyboard.press('Enter')
-        await asyncio.sleep(25)
-        await save_html(page, departure, destination, departure_date, return_date,country_id)
-        # Correctly closing context and browser at the end of the function.
-        await context.close()
-        await browser.close()
+
+        # Move on as soon as the search results arrived instead of sleeping for the worst case
+        print("Waiting for GetShopping response")
+        if await wait_for_step("results", shopping_saved.wait()):
+            await wait_for_step("results_render", page.wait_for_load_state("networkidle"))
+        await save_html(page, departure, destination, departure_date, return_date,country_id, session.writer)
+        # Let pending response handlers finish reading their bodies before the context is closed
+        await asyncio.gather(*response_tasks)
+        return shopping_saved.is_set()
 
 
 if __name__ == "__main__":
@@ -205,5 +1222,22 @@ if __name__ == "__main__":
     queries_dataset = load_json_file(args.query_file)
     proxy_configs = load_json_file(args.proxy_file)
     custom_headers = load_json_file(args.headers_file)
+    if args.work_queue:
+        manifest = LeaseStore(args.work_queue, args.worker_id, args.lease_seconds or 2 * args.timeout, max_attempts=args.max_retries + 1)
+        manifest.seed(queries_dataset, proxy_configs)
+        print(f"Worker {args.worker_id} joining work queue {args.work_queue}: {manifest.summary()}")
+    elif args.manifest:
+        manifest = CrawlManifest(args.manifest)
+        print(f"Resuming with manifest {args.manifest}: {manifest.summary()}")
+    else:
+        manifest = None
+    metrics = CrawlMetrics(args.metrics_file, args.prometheus_file)
 
-    asyncio.run(run_queries_sequentially_with_multiple_proxies(queries_dataset, proxy_configs, custom_headers, timeout=80))
\ No newline at end of file
+    try:
+        asyncio.run(run_crawl(args, queries_dataset, proxy_configs, manifest, metrics))
+    finally:
+        metrics.print_summary()
+        metrics.close()
+        if manifest is not None:
+            print(f"Crawl progress: {manifest.summary()}")
+            manifest.close()
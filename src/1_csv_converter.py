@@ -2,6 +2,41 @@ from bs4 import BeautifulSoup
 import pandas as pd
 import os
 import glob
+import gzip
+import hashlib
+import html
+import json
+import re
+import sys
+import argparse
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+
+def open_artifact(file_path):
+    """Open a crawler artifact for reading, transparently decompressing gzip files (*.gz)."""
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    return open(file_path, 'r', encoding='utf-8')
+
+
+def artifact_base_name(file_path):
+    """File name without the artifact extension, e.g. GB_DEN_to_SFO_... for GB_DEN_to_SFO_....json.gz"""
+    name = os.path.basename(file_path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+
+def find_artifact(directory, base_name, extension):
+    """Locate the plain or gzip-compressed artifact for base_name, or return None."""
+    for candidate in (f'{base_name}{extension}', f'{base_name}{extension}.gz'):
+        path = os.path.join(directory, candidate)
+        if os.path.exists(path):
+            return path
+    return None
 
 
 def clean_string(s):
@@ -146,7 +181,7 @@ def clean_key_4(data):
 
 
 
-# Main function to process the raw dictionary and output a pandas Series
+# Main function to process the raw dictionary and output one journey record
 def process_flight_data(raw_data):
     # Remove irrelevant keys
     raw_data.pop(-1, None)
@@ -162,53 +197,40 @@ def process_flight_data(raw_data):
     last_flight = clean_key_4(raw_data[4])
     
     cleaned_data = {**general_info, **selling_airline_info, **flights_info, **journey_info,**last_flight,**journey_info2}
+    return cleaned_data
 
-    
-    # Convert to pandas Series
-    cleaned_df = pd.DataFrame([cleaned_data])
-    return cleaned_df
+
+BRACKETS = re.compile(r'([\[\]])')
 
 
 def parse_nested_string_v2(s):
-    level_dict = {}
-    current_str = ""
+    """
+    Group the comma-separated tokens of a journey string by bracket depth: {depth: [token, ...]}.
+    Only the brackets are visited in Python: the text between them is collected per depth and split on commas
+    in one go. A '[' at depth 0 or less does not end a token, so the text after the last comma before it is
+    carried into the deeper level.
+    """
+    pieces = BRACKETS.split(s)  # text, bracket, text, bracket, ..., text
+    texts = {}
     open_brackets = 0
-
-    for char in s:
-        if char == '[':
-            if open_brackets > 0:  # Only add non-empty strings and when not at the root
-                current_str = current_str.strip()
-                if current_str:  # Add current object to the level before going deeper
-                    if open_brackets not in level_dict:
-                        level_dict[open_brackets] = []
-                    level_dict[open_brackets].append(current_str)
-                    current_str = ""
+    for index in range(1, len(pieces), 2):
+        text = pieces[index - 1]
+        if pieces[index] == '[':
+            if open_brackets <= 0:
+                text, _, carried = text.rpartition(',')
+                pieces[index + 1] = carried + pieces[index + 1]
+            texts.setdefault(open_brackets, []).append(text)
             open_brackets += 1
-        elif char == ']':
-            current_str = current_str.strip()
-            if current_str:  # Add current object to the level before exiting
-                if open_brackets not in level_dict:
-                    level_dict[open_brackets] = []
-                level_dict[open_brackets].append(current_str)
-                current_str = ""
-            open_brackets -= 1
-        elif char == ',':
-            current_str = current_str.strip()
-            if current_str:  # Add current object to the level and reset for the next object
-                if open_brackets not in level_dict:
-                    level_dict[open_brackets] = []
-                level_dict[open_brackets].append(current_str)
-                current_str = ""
         else:
-            current_str += char
-
-    # Handle any remaining string outside of the loop
-    current_str = current_str.strip()
-    if current_str:
-        if open_brackets not in level_dict:
-            level_dict[open_brackets] = []
-        level_dict[open_brackets].append(current_str)
+            texts.setdefault(open_brackets, []).append(text)
+            open_brackets -= 1
+    texts.setdefault(open_brackets, []).append(pieces[-1])
 
+    level_dict = {}
+    for depth, parts in texts.items():
+        tokens = [token for token in map(str.strip, ','.join(parts).split(',')) if token]
+        if tokens:
+            level_dict[depth] = tokens
     return level_dict
 
 def add_key_four_if_missing(parsed_dict):
@@ -229,88 +251,439 @@ def add_key_four_if_missing(parsed_dict):
 
     return parsed_dict
 
-# Function to process a single JSON file
+# Output columns of one journey, in the order process_flight_data produces them
+JOURNEY_COLUMNS = ["airline_code", "departure_airport_code", "destination_airport_code", "selling_airline",
+                   "ticket_price", "departure_date", "arrival_date", "First_flight", "first_flight_code",
+                   "last_flight_code", "departure_time", "arrival_time"]
+META_COLUMNS = ["Detected_Language", "Detected_Country", "Detected_Currency"]
+OUTPUT_COLUMNS = JOURNEY_COLUMNS + META_COLUMNS
+
+
+# Function to process a single JSON file into a list of journey records
 def process_json_file(json_file_path):
-    # Assuming parse_nested_string_v2 and other necessary parsing functions are defined elsewhere
-    with open(json_file_path, 'r') as json_file:
+    with open_artifact(json_file_path) as json_file:
         short_json_string = json_file.read()
-        unescaped_json = bytes(short_json_string, "utf-8").decode("unicode_escape")
-        splitted_json = unescaped_json.split("[\\\"")[1:-1]
+    unescaped_json = bytes(short_json_string, "utf-8").decode("unicode_escape")
+    splitted_json = unescaped_json.split("[\\\"")[1:-1]
 
-    Journeys = []
+    journeys = []
     for journey in splitted_json:
         parsed_journey = parse_nested_string_v2(journey)
         # Assuming add_key_four_if_missing is defined and corrects the parsed journey as needed
         final_journey = add_key_four_if_missing(parsed_journey)
-        Journeys.append(final_journey)
+        journeys.append(process_flight_data(final_journey))
+    return journeys
+
+META_SPAN_CLASS = 'twocKe'
+META_FIELDS = 3  # Language, country and currency, in page order
+HTML_READ_SIZE = 1 << 20
+# Attributes, whose quoted values may contain '>'. Written as unrolled loops, which never backtrack on a tag
+# cut off by the end of the buffer.
+TAG_BODY = r"""[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*"""
+# The same when not naming the metadata class; only its first letter triggers a lookahead
+_FIRST, _REST = META_SPAN_CLASS[0], META_SPAN_CLASS[1:]
+UNMARKED_TAG_BODY = (rf"""[^>"'{_FIRST}]*(?:(?:{_FIRST}(?!{_REST})"""
+                     rf"""|"[^"{_FIRST}]*(?:{_FIRST}(?!{_REST})[^"{_FIRST}]*)*\""""
+                     rf"""|'[^'{_FIRST}]*(?:{_FIRST}(?!{_REST})[^'{_FIRST}]*)*')[^>"'{_FIRST}]*)*""")
+# A comment, or a start/end tag
+HTML_TOKEN = re.compile(rf"""<!--.*?-->|<(/?)([A-Za-z][^\s/>]*)({TAG_BODY})>""", re.DOTALL)
+# A comment or tag cut off by the end of the buffer
+PARTIAL_HTML_TOKEN = re.compile(rf"""<(?:!(?:-(?:-(?:(?!-->).)*)?)?|/?(?:[A-Za-z]{TAG_BODY}(?:"[^"]*|'[^']*)?)?)?\Z""",
+                                re.DOTALL)
+# Text, stray '<'s, declarations and complete tags other than span, script and style, skipped in one match
+HTML_SKIP = re.compile(rf"""(?:[^<]+|<(?!!--|(?i:/?span|script|style)[\s/>])[A-Za-z/]{TAG_BODY}>"""
+                       r"""|<(?=[^A-Za-z/!])|<!(?!--)[^>]*>)*""")
+# The same outside metadata spans, where other spans do not matter: skips every tag not naming the class
+HTML_SKIP_OUTSIDE = re.compile(rf"""(?:[^<]+|<(?!!--|(?i:script|style)[\s/>])[A-Za-z/]{UNMARKED_TAG_BODY}>"""
+                               r"""|<(?=[^A-Za-z/!])|<!(?!--)[^>]*>)*""")
+HTML_ATTR = re.compile(r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+# Elements whose content is raw text, so markup inside them is no element (as in html.parser)
+RAW_TEXT_END = {name: re.compile(rf'</{name}\s*>', re.IGNORECASE) for name in ('script', 'style')}
+# Markup left out of an element's text: comments, declarations, script/style elements and tags
+HTML_MARKUP = re.compile(rf"""<!--.*?-->|<![^>]*>|<(script|style)\b{TAG_BODY}>.*?</\1\s*>|</?[A-Za-z]{TAG_BODY}>""",
+                         re.DOTALL | re.IGNORECASE)
+
+
+def has_metadata_class(attributes):
+    for attribute in HTML_ATTR.finditer(attributes):
+        if attribute.group(1).lower() == 'class':
+            value = next((group for group in attribute.groups()[1:] if group is not None), '')
+            return META_SPAN_CLASS in value.split()
+    return False
+
+
+def element_text(fragment):
+    """Text of an HTML fragment as get_text() gives it: whitespace-only strings collapse to one space or newline."""
+    strings, pos = [], 0
+    for markup in [*HTML_MARKUP.finditer(fragment), None]:
+        string = html.unescape(fragment[pos:markup.start() if markup else len(fragment)])
+        if string and not string.strip(' \t\n\r\f'):
+            string = '\n' if '\n' in string else ' '
+        strings.append(string)
+        pos = markup.end() if markup else pos
+    return ''.join(strings)
+
+
+def scan_metadata_spans(html_file, count=META_FIELDS):
+    """
+    Return the texts of the first `count` span.twocKe elements of an HTML stream. The page is read in chunks and
+    tokenized into comments and tags (quote-aware, skipping script/style content); scanning stops once those spans
+    are closed, so no tree is built and the rest of the page is never read.
+    """
+    buffer, pos, eof = '', 0, False
+    texts = []  # Start offset of each metadata span's text until it is closed, then the text
+    open_spans = []  # Index into texts of every span opened inside a metadata span, None for other spans
+    while len(texts) < count or any(isinstance(text, int) for text in texts[:count]):
+        pos = (HTML_SKIP if open_spans else HTML_SKIP_OUTSIDE).match(buffer, pos).end()
+        token = HTML_TOKEN.match(buffer, pos)
+        if token is None and pos < len(buffer) and not PARTIAL_HTML_TOKEN.match(buffer, pos):
+            pos += 1  # A '<' that starts no tag
+            continue
+        raw_text = token is not None and not token.group(1) and (token.group(2) or '').lower() in RAW_TEXT_END
+        raw_end = RAW_TEXT_END[token.group(2).lower()].search(buffer, token.end()) if raw_text else None
+        if token is None or (raw_text and raw_end is None):
+            # The next token, or the end of a script/style element, is not buffered yet
+            if eof:
+                break
+            chunk = html_file.read(HTML_READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
 
-    df_json = pd.DataFrame()
-    for journey in Journeys:
-        temp_df = process_flight_data(journey)  # Assuming this function is defined and processes each journey
-        df_json = pd.concat([df_json, temp_df], ignore_index=True)
-    
-    return df_json
+        closing, name, attributes = token.groups()
+        pos = raw_end.end() if raw_end else token.end()
+        if name is None or name.lower() != 'span' or attributes.rstrip().endswith('/'):
+            continue
+        if not closing and has_metadata_class(attributes):
+            open_spans.append(len(texts))
+            texts.append(token.end())
+        elif not closing and open_spans:
+            open_spans.append(None)
+        elif open_spans:
+            index = open_spans.pop()
+            if index is not None:
+                texts[index] = buffer[texts[index]:token.start()]
+    # Spans still open at the end of the page run to its end
+    texts = [buffer[text:] if isinstance(text, int) else text for text in texts[:count]]
+    return [element_text(text) for text in texts]
+
+
+def bs4_metadata_spans(html_file):
+    """Reference implementation of scan_metadata_spans on a full BeautifulSoup tree."""
+    soup = BeautifulSoup(html_file, 'html.parser')
+    return [element.text for element in soup.find_all('span', class_=META_SPAN_CLASS)[:META_FIELDS]]
+
+
+# Function to extract the page metadata from a corresponding HTML file
+def process_html_file(html_file_path, html_parser="fast"):
+    with open_artifact(html_file_path) as html_file:
+        if html_parser == "bs4":
+            texts = bs4_metadata_spans(html_file)
+        else:
+            texts = scan_metadata_spans(html_file)
 
-# Function to process a corresponding HTML file
-def process_html_file(html_file_path, df_json_length):
-    with open(html_file_path, 'r') as html_file:
-        soup = BeautifulSoup(html_file, 'html.parser')
-    elements = soup.find_all('span', class_='twocKe')
-    
     meta_data = {}
-    if len(elements) >= 3:  # Assuming there are 3 metadata fields to extract
+    if len(texts) >= META_FIELDS:
         meta_data = {
-            "Detected_Language": elements[0].text,
-            "Detected_Country": elements[1].text,
-            "Detected_Currency": elements[2].text
+            "Detected_Language": texts[0],
+            "Detected_Country": texts[1],
+            "Detected_Currency": texts[2]
         }
     else:
         print(f"Metadata missing or incomplete in {html_file_path}.")
-    
-    # Repeat the metadata for each row in df_json
-    df_meta = pd.DataFrame([meta_data] * df_json_length)
-    return df_meta
-
-# Function to merge JSON and HTML extracted data
-def merge_data_frames(df_json, df_html):
-    result_df = pd.concat([df_json.reset_index(drop=True), df_html.reset_index(drop=True)], axis=1)
-    return result_df
+    return meta_data
+
+
+def verify_html_extractors(html_files):
+    """Compare the fast and the BeautifulSoup metadata extraction on the given pages. Returns the number of mismatches."""
+    mismatches = 0
+    for html_file_path in sorted(html_files):
+        fast = process_html_file(html_file_path, "fast")
+        reference = process_html_file(html_file_path, "bs4")
+        if fast != reference:
+            mismatches += 1
+            print(f"Mismatch in {html_file_path}: fast={fast} bs4={reference}")
+    print(f"Checked {len(html_files)} pages, {mismatches} mismatches.")
+    return mismatches
+
+
+def find_page_metadata(html_directory_path, json_file_path):
+    """
+    The HTML page of a response or, for RPC crawls, the <name>.meta.json written in its place; None if neither exists.
+    """
+    base_name = artifact_base_name(json_file_path)
+    return find_artifact(html_directory_path, base_name, '.html') or find_artifact(html_directory_path, base_name, '.meta.json')
+
+
+def convert_file_pair(json_file_path, html_directory_path, html_parser="fast"):
+    """
+    Convert one response and its HTML page (or the .meta.json of an RPC crawl) into records: every journey of the
+    response joined with the page metadata. Returns an empty list if there is nothing to add.
+    """
+    journeys = process_json_file(json_file_path)
+    if not journeys:
+        print(f"No data to concatenate for {json_file_path}")
+        return []
+
+    page_file_path = find_page_metadata(html_directory_path, json_file_path)
+    if page_file_path is None:
+        print(f"Corresponding HTML file not found for {json_file_path}")
+        return []
+    if page_file_path.endswith(('.meta.json', '.meta.json.gz')):
+        with open_artifact(page_file_path) as meta_file:
+            meta_data = {key: value for key, value in json.load(meta_file).items() if key in META_COLUMNS}
+    else:
+        meta_data = process_html_file(page_file_path, html_parser)
+    return [{**journey, **meta_data} for journey in journeys]
+
+
+def convert_file_pair_safely(job):
+    """
+    Pool entry point: convert one (json_file_path, html_directory_path, html_parser) job and return
+    (json_file_path, records, error) so one broken file does not abort the whole run.
+    """
+    json_file_path = job[0]
+    try:
+        return json_file_path, convert_file_pair(*job), None
+    except Exception:
+        return json_file_path, [], traceback.format_exc()
+
+
+def convert_batch_safely(jobs):
+    """Pool entry point: convert a batch of jobs, so pickling overhead is paid per batch rather than per file pair."""
+    return [convert_file_pair_safely(job) for job in jobs]
+
+
+def iter_converted(json_files, html_directory_path, html_parser="fast", workers=1, batch_size=16):
+    """
+    Convert response files and yield (json_file_path, records, error) per file. Files are processed in sorted
+    order and, with workers > 1, in a process pool whose results are yielded in that same order,
+    so the output does not depend on the number of workers. At most two batches per worker are in flight,
+    so results never pile up in memory faster than the consumer handles them.
+    """
+    jobs = [(json_file_path, html_directory_path, html_parser) for json_file_path in sorted(json_files)]
+    if workers <= 1:
+        yield from map(convert_file_pair_safely, jobs)
+        return
+
+    batches = (jobs[start:start + batch_size] for start in range(0, len(jobs), batch_size))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(convert_batch_safely, batch))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def iter_records(results, failures):
+    """Flatten per-file results into records, reporting and collecting failed files on the way."""
+    for json_file_path, file_records, error in results:
+        if error is not None:
+            print(f"Failed to convert {json_file_path}:\n{error}")
+            failures.append(json_file_path)
+            continue
+        yield from file_records
+
+
+def iter_frames(records, chunk_size):
+    """Group a record stream into DataFrames of at most chunk_size rows."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame.from_records(chunk, columns=OUTPUT_COLUMNS)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame.from_records(chunk, columns=OUTPUT_COLUMNS)
+
+
+def filter_prices(df, min_price=2):
+    """Drop rows without a usable ticket price (missing, unparsable or a placeholder of min_price or less)."""
+    df['ticket_price'] = pd.to_numeric(df['ticket_price'], errors='coerce')
+    return df[df['ticket_price'] > min_price]
+
+
+def write_csv_chunks(frames, output_file_path):
+    """
+    Append DataFrame chunks to a CSV file, writing the header once. The file is written under a temporary
+    name and renamed at the end, so an interrupted run never leaves a truncated result behind. Returns the row count.
+    """
+    temp_file_path = output_file_path + '.tmp'
+    rows = 0
+    with open(temp_file_path, 'w', encoding='utf-8', newline='') as f:
+        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(f, index=False)
+        for frame in frames:
+            frame.to_csv(f, index=False, header=False)
+            rows += len(frame)
+    os.replace(temp_file_path, output_file_path)
+    return rows
+
+
+def report_failures(failures, total):
+    if failures:
+        print(f"{len(failures)} of {total} files failed to convert:")
+        for json_file_path in failures:
+            print(f"  {json_file_path}")
+
+
+STATE_FILE_NAME = '_conversion_state.json'  # Leading underscore: ignored by Parquet dataset readers
+LIST_COLUMNS = ["departure_date", "arrival_date"]
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_conversion_state(dataset_directory):
+    """Read the {json_file_path: {sha256, size, mtime_ns, part}} record of already converted files."""
+    state_path = os.path.join(dataset_directory, STATE_FILE_NAME)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+
+def save_conversion_state(dataset_directory, state):
+    state_path = os.path.join(dataset_directory, STATE_FILE_NAME)
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def select_changed_files(json_files, state):
+    """
+    Return ({json_file_path: fingerprint}, unchanged) for files that are new or whose content changed.
+    Files with the size and mtime recorded in the state are not re-hashed.
+    """
+    changed, unchanged = {}, 0
+    for json_file_path in json_files:
+        stat = os.stat(json_file_path)
+        previous = state.get(json_file_path)
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            unchanged += 1
+            continue
+        fingerprint = {'sha256': file_sha256(json_file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if previous and previous['sha256'] == fingerprint['sha256']:
+            # Touched but identical; remember the new stat so the file is not hashed again
+            previous.update(fingerprint)
+            unchanged += 1
+            continue
+        changed[json_file_path] = fingerprint
+    return changed, unchanged
+
+
+def partition_path(json_file_path, fingerprint):
+    """
+    Dataset-relative part file for one response: crawl_date=<day the response was saved>/country=<query country>/.
+    The country is the prefix of the artifact name (e.g. GB in GB_DEN_to_SFO_...), the crawl date the file's modification day (UTC).
+    """
+    base_name = artifact_base_name(json_file_path)
+    country = base_name.split('_', 1)[0]
+    crawl_date = datetime.fromtimestamp(fingerprint['mtime_ns'] / 1e9, tz=timezone.utc).strftime('%Y-%m-%d')
+    part_name = f"part-{hashlib.sha1(base_name.encode('utf-8')).hexdigest()[:16]}.parquet"
+    return os.path.join(f"crawl_date={crawl_date}", f"country={country}", part_name)
+
+
+def write_parquet_part(records, dataset_directory, relative_path):
+    """Write the records of one response as a part file, with the price filter of the CSV export. Returns the rows written."""
+    df = filter_prices(pd.DataFrame.from_records(records, columns=OUTPUT_COLUMNS))
+    # Stored the way the CSV holds them, so downstream parsing of the date lists is the same for both outputs
+    for column in LIST_COLUMNS:
+        df[column] = df[column].map(lambda value: str(value) if isinstance(value, list) else value)
+
+    part_path = os.path.join(dataset_directory, relative_path)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    df.to_parquet(part_path + '.tmp', engine='pyarrow', index=False)
+    os.replace(part_path + '.tmp', part_path)
+    return len(df)
+
+
+def convert_incrementally(json_files, html_directory_path, dataset_directory, html_parser="fast", workers=1):
+    """
+    Convert only new or changed response files into a Parquet dataset partitioned by crawl date and country.
+    Every response file becomes one part file, so a changed file replaces its previous rows instead of duplicating them.
+    Returns the list of files that failed to convert; they are retried on the next run.
+    """
+    os.makedirs(dataset_directory, exist_ok=True)
+    state = load_conversion_state(dataset_directory)
+    changed, unchanged = select_changed_files(json_files, state)
+    print(f"{len(changed)} new or changed files, {unchanged} already converted.")
+
+    failures, rows = [], 0
+    try:
+        for json_file_path, records, error in iter_converted(changed, html_directory_path, html_parser, workers):
+            if error is not None:
+                print(f"Failed to convert {json_file_path}:\n{error}")
+                failures.append(json_file_path)
+                continue
+
+            if not records and find_page_metadata(html_directory_path, json_file_path) is None:
+                # The page may still arrive; leave the file out of the state so the next run tries again
+                continue
+
+            fingerprint = changed[json_file_path]
+            previous_part = state.get(json_file_path, {}).get('part')
+            part = partition_path(json_file_path, fingerprint) if records else None
+            if records:
+                rows += write_parquet_part(records, dataset_directory, part)
+            if previous_part and previous_part != part:
+                previous_part_path = os.path.join(dataset_directory, previous_part)
+                if os.path.exists(previous_part_path):
+                    os.remove(previous_part_path)
+            state[json_file_path] = {**fingerprint, 'part': part}
+    finally:
+        # Saved even when interrupted, so finished files are not converted again
+        save_conversion_state(dataset_directory, state)
+
+    print(f"Appended {rows} rows to {dataset_directory}.")
+    return failures
+
+
+def setup_arg_parser():
+    """Setup CLI argument parser."""
+    parser = argparse.ArgumentParser(description='Convert crawled GetShopping responses and HTML pages into a CSV file.')
+    parser.add_argument('--html_parser', choices=['fast', 'bs4'], default='fast', help='HTML metadata extraction: targeted scan or a full BeautifulSoup tree (default: fast)')
+    parser.add_argument('--verify_html', action='store_true', help='Compare both HTML metadata extractors on all HTML pages and exit')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes converting file pairs in parallel (default: 1)')
+    parser.add_argument('--chunk_size', type=int, default=50000, help='Rows buffered before they are written to the CSV (default: 50000)')
+    parser.add_argument('--incremental', action='store_true', help='Convert only new or changed responses and add them to a Parquet dataset instead of rewriting the CSV')
+    parser.add_argument('--dataset_dir', default='../data/query_results/flights_dataset', help='Parquet dataset used by --incremental, partitioned by crawl_date and country')
+    return parser.parse_args()
 
 # Main processing loop
 def main():
+    args = setup_arg_parser()
     json_directory_path = '../data/2.crawler_output/json_collections/responses'
     html_directory_path = '../data/2.crawler_output/html_collections/html_pages'
     
     output_directory = '../data/query_results'
-    json_files = glob.glob(os.path.join(json_directory_path, '*.json'))
+    json_files = glob.glob(os.path.join(json_directory_path, '*.json')) + glob.glob(os.path.join(json_directory_path, '*.json.gz'))
 
-    df_combined = pd.DataFrame()
+    if args.verify_html:
+        html_files = glob.glob(os.path.join(html_directory_path, '*.html')) + glob.glob(os.path.join(html_directory_path, '*.html.gz'))
+        sys.exit(1 if verify_html_extractors(html_files) else 0)
 
-    for json_file_path in json_files:
-        df_json = process_json_file(json_file_path)
-        if df_json.empty:
-            print(f"No data to concatenate for {json_file_path}")
-            continue  # Skip further processing for this file
-
-        base_name = os.path.splitext(os.path.basename(json_file_path))[0]
-        html_file_path = os.path.join(html_directory_path, f'{base_name}.html')
-
-        if os.path.exists(html_file_path):
-            df_html = process_html_file(html_file_path, len(df_json))
-            result_df = merge_data_frames(df_json, df_html)
-            df_combined = pd.concat([df_combined, result_df], ignore_index=True)
-        else:
-            print(f"Corresponding HTML file not found for {json_file_path}")
-    
-    # Additional data processing steps
-    df_combined['ticket_price'] = pd.to_numeric(df_combined['ticket_price'], errors='coerce')
-    df_filtered = df_combined[df_combined['ticket_price'] > 2]
+    if args.incremental:
+        failures = convert_incrementally(json_files, html_directory_path, args.dataset_dir, html_parser=args.html_parser, workers=args.workers)
+        report_failures(failures, len(json_files))
+        return
+
+    # Stream files -> parsed and joined records -> filtered chunks -> CSV; only one chunk of rows is held at a time
+    failures = []
+    results = iter_converted(json_files, html_directory_path, html_parser=args.html_parser, workers=args.workers)
+    frames = (filter_prices(frame) for frame in iter_frames(iter_records(results, failures), args.chunk_size))
 
-    # Save the combined DataFrame to a CSV file
-    if not os.path.exists(output_directory):
-        os.makedirs(output_directory)
+    os.makedirs(output_directory, exist_ok=True)
     output_file_path = os.path.join(output_directory, "Query0304_results.csv")
-    df_combined.to_csv(output_file_path, index=False)
+    rows = write_csv_chunks(frames, output_file_path)
+    print(f"Wrote {rows} rows to {output_file_path}.")
+    report_failures(failures, len(json_files))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,10 @@
 import argparse
+import glob
 import json
 import os
-import ast
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from datetime import datetime
-from scipy.stats import trim_mean
 
 
 def get_absolute_path(relative_path):
@@ -18,42 +17,55 @@ def get_absolute_path(relative_path):
     # Build an absolute path by combining the script's directory with the relative path:
     return os.path.join(script_dir, relative_path)
 
-def clean_fifth_element(lst):
-    cleaned_lst = []
-    for item in lst:
-        if len(item) >= 5:
-            fifth_element = item[4]
-            if isinstance(fifth_element, int):
-                cleaned_lst.append(item[:4] + [fifth_element] + item[5:])
-            else:
-                try:
-                    cleaned_lst.append(item[:4] + [int(fifth_element)] + item[5:])
-                except ValueError:
-                    # If the fifth element cannot be converted to an integer, replace it with 0
-                    cleaned_lst.append(item[:4] + [0] + item[5:])
-        else:
-            # If the list is too short, consider the fifth element as 0
-            cleaned_lst.append(item[:4] + [0])
-    return cleaned_lst
-
-
-def convert_list_to_datetime(date_list):
-    # Convert 'null' strings to 0 and other elements to integers
-    date_list = [0 if element == 'null' else int(element) for element in date_list]
-    
-    try:
-        if len(date_list) == 5:
-            # If all components are present, unpack the list directly into datetime
-            return datetime(*date_list)
-        elif len(date_list) == 4:
-            # If the minute is missing (or any single component), append 0 for minutes and then convert
-            return datetime(*(date_list + [0]))
-        else:
-            # Return None for lists of unexpected length to indicate an issue
-            return None
-    except TypeError:
-        # Handle cases where the list contents cannot be directly unpacked into datetime
-        return None
+def parse_date_lists(series):
+    """
+    Parses stringified [Y, M, D, h, m] lists (e.g. "['2024', '3', '28', '8', '5']") into datetime64 values in bulk.
+    - A missing minute, or a minute that is not an integer such as 'null', counts as 0.
+    - A 'null' year, month, day or hour counts as 0; a list of only [Y, M, D] means midnight.
+    - Lists with fewer than 3 or more than 5 elements, non-numeric parts and impossible dates become NaT.
+
+    >>> parse_date_lists(pd.Series(["['2024', '5', '3']", "['2024', '5', '3', '10']", "[2024, 5, 3, 10, 45]"])).tolist()
+    [Timestamp('2024-05-03 00:00:00'), Timestamp('2024-05-03 10:00:00'), Timestamp('2024-05-03 10:45:00')]
+    >>> parse_date_lists(pd.Series(["['2024', '5', '3', '10', 'null']", None, "['2024', '5']"])).tolist()
+    [Timestamp('2024-05-03 10:00:00'), NaT, NaT]
+    >>> parse_date_lists(pd.Series([], dtype=object)).tolist()
+    []
+    """
+    if series.empty:
+        return pd.Series(index=series.index, dtype='datetime64[ns]', name=series.name)
+    parts = (series.astype('string')
+             .str.replace(r"[\"'\s\[\]]", '', regex=True)
+             .str.split(',', expand=True))
+    # Positions no list reaches (and all-missing columns) come back as float NaN; keep them strings for .str
+    parts = parts.reindex(columns=range(max(parts.shape[1], 5))).astype('string')
+    length = parts.notna().sum(axis=1)
+
+    def component(position):
+        values = parts[position].replace('null', '0')
+        return pd.to_numeric(values, errors='coerce').astype('float64')
+
+    minute = pd.to_numeric(parts[4].where(parts[4].str.fullmatch(r'-?\d+', na=False)), errors='coerce').astype('float64').fillna(0)
+    components = pd.DataFrame({
+        'year': component(0),
+        'month': component(1),
+        'day': component(2),
+        'hour': component(3).where(length >= 4, 0),
+        'minute': minute.where(length == 5, 0),
+    })
+    components[~length.between(3, 5)] = np.nan
+    return pd.to_datetime(components, errors='coerce')
+
+
+def parse_date_list_column(series):
+    """
+    Parses a column of stringified date lists into datetime64. Every flight is queried from many countries,
+    so the same date strings repeat; each distinct string is parsed once and the result broadcast back.
+    """
+    codes, uniques = pd.factorize(series)
+    parsed = parse_date_lists(pd.Series(uniques, dtype=object)).to_numpy()
+    # Code -1 (missing value) picks the trailing NaT
+    parsed = np.append(parsed, np.datetime64('NaT', 'ns'))
+    return pd.Series(parsed[codes], index=series.index, name=series.name)
 
 
 def load_config(filename):
@@ -67,6 +79,16 @@ def load_config(filename):
     return config.get("data_configurations", {}).get(filename, {})
 
 
+def load_configured_filenames():
+    """
+    Returns the names of all query files listed in the configuration file, in their configured order.
+    """
+    config_file_path = get_absolute_path('../config/preproccessing_config.json')
+    with open(config_file_path) as config_file:
+        config = json.load(config_file)
+    return list(config.get("data_configurations", {}))
+
+
 def load_dataset(df_path):
     """
     Load and return the dataset from the specified path.
@@ -79,33 +101,70 @@ def load_dataset(df_path):
         exit(1)
 
 
+FLIGHT_ID_COLUMNS = ['airline_code', 'departure_airport_code', 'destination_airport_code',
+                     'First_flight', 'last_flight_code', 'arrival_date', 'departure_date',
+                     'departure_time', 'selling_airline', 'arrival_time', 'first_flight_code']
+
+# Low-cardinality text columns stored as categoricals in compact mode. Ordered by value,
+# so min() over a categorical picks the same country as over the strings.
+CATEGORICAL_COLUMNS = ['airline_code', 'departure_airport_code', 'destination_airport_code',
+                       'Detected_Language', 'Detected_Country', 'Detected_Currency']
+
+
+def hash_columns(df, columns):
+    """64-bit hash of the combined values of `columns` for every row, as int64."""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy().view(np.int64)
+
+
+def hash_duplicate_key(df):
+    """
+    64-bit hash of the duplicate key of remove_duplicates_and_erroneous_rows (Flight_ID, country, language
+    and ticket price) for every row, as int64. A missing country or language made the concatenated key NaN,
+    so all such rows were one duplicate group; they share the key -1.
+    """
+    key_columns = df[['Flight_ID', 'Detected_Country', 'Detected_Language']].assign(ticket_price=df['ticket_price'].astype('float64'))
+    missing_part = df[['Detected_Country', 'Detected_Language']].isna().any(axis=1).to_numpy()
+    return np.where(missing_part, -1, hash_columns(key_columns, list(key_columns.columns)))
+
+
+def convert_to_compact_dtypes(df):
+    """
+    Converts the airport, airline, country, currency and language columns to ordered categoricals.
+    """
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = pd.Categorical(df[col], ordered=True)
+    return df
+
+
 def create_flight_id(df):
     """
     Creates a unique FlightID for each flight based on several columns and removes unnecessary columns.
     """
-    id_columns = ['airline_code', 'departure_airport_code', 'destination_airport_code',
-                  'First_flight', 'last_flight_code', 'arrival_date', 'departure_date',
-                  'departure_time', 'selling_airline', 'arrival_time', 'first_flight_code']
-    df['Flight_ID'] = df[id_columns].astype(str).agg('-'.join, axis=1)
+    df['Flight_ID'] = df[FLIGHT_ID_COLUMNS].astype(str).agg('-'.join, axis=1)
     df.drop(['departure_time', 'selling_airline', 'arrival_time'], axis=1, inplace=True)
     return df
 
+
+def create_compact_flight_id(df):
+    """
+    Compact variant of create_flight_id: Flight_ID is a 64-bit hash of the same columns.
+    Returns (df, flight_id_labels), a Series mapping every hash to the readable Flight_ID of
+    create_flight_id; the strings are only built once per distinct flight.
+    """
+    df['Flight_ID'] = hash_columns(df, FLIGHT_ID_COLUMNS)
+    first_rows = df.loc[~df['Flight_ID'].duplicated(), FLIGHT_ID_COLUMNS + ['Flight_ID']]
+    flight_id_labels = pd.Series(first_rows[FLIGHT_ID_COLUMNS].astype(str).agg('-'.join, axis=1).to_numpy(),
+                                 index=first_rows['Flight_ID'].to_numpy())
+    df.drop(['departure_time', 'selling_airline', 'arrival_time'], axis=1, inplace=True)
+    return df, flight_id_labels
+
 def convert_date_columns(df):
     """
-    Processes 'arrival_date' and 'departure_date' columns in the DataFrame.
-    1. Converts string representations of lists into actual lists using ast.literal_eval.
-    2. Cleans the data within these lists using the clean_fifth_element function.
-    3. Converts the lists into datetime objects using the convert_list_to_datetime function.
+    Converts the stringified date lists in 'arrival_date' and 'departure_date' into datetime64 columns
+    using the vectorized parse_date_list_column.
     """
     for col in ['arrival_date', 'departure_date']:
-        # Convert string representations to lists
-        df[col] = df[col].apply(ast.literal_eval)
-
-        # Clean the lists
-        df[col] = clean_fifth_element(df[col])
-
-        # Convert lists to datetime objects
-        df[col] = df[col].apply(convert_list_to_datetime)
+        df[col] = parse_date_list_column(df[col])
     
     return df
 
@@ -125,16 +184,20 @@ def load_initial_configuration(filename):
     
     return conversion_rates, query_date
 
-def remove_duplicates_and_erroneous_rows(df):
+def remove_duplicates_and_erroneous_rows(df, compact=False):
     """
     Removes duplicates based on a composite key and drops rows with missing or erroneous data.
     - Duplicates are identified based on a composite of 'Flight_ID', 'Detected_Country', 'Detected_Language',
       'Detected_Country' again for emphasis, and 'ticket_price'.
+    - In compact mode the composite key is a 64-bit hash of those columns instead of a concatenated string.
     - Erroneous rows are defined as those missing critical information or having a 'ticket_price' below a threshold.
     """
     # Create a composite key for identifying duplicates
-    df["Duplicate_checker"] = (df['Flight_ID'] + df['Detected_Country'] + df["Detected_Language"] +
-                               df["Detected_Country"] + df["ticket_price"].astype(str))
+    if compact:
+        df["Duplicate_checker"] = hash_duplicate_key(df)
+    else:
+        df["Duplicate_checker"] = (df['Flight_ID'] + df['Detected_Country'] + df["Detected_Language"] +
+                                   df["Detected_Country"] + df["ticket_price"].astype(str))
     
     # Remove duplicates based on the composite key
     df = df.drop_duplicates(subset='Duplicate_checker', keep='first')
@@ -148,23 +211,18 @@ def remove_duplicates_and_erroneous_rows(df):
     
     return df
 
-def convert_to_usd(row, price_col_name, currency_col_name, conversion_rates):
-    price = row[price_col_name]
-    currency = row[currency_col_name]
-    conversion_rate = conversion_rates.get(currency)
-
-    if conversion_rate is None:
-        raise ValueError(f"Conversion rate for currency '{currency}' is not available.")
-    
-    return price * conversion_rate
-
-
-
 def convert_prices_to_usd(df, price_column, currency_column, conversion_rates):
     """
     Converts ticket prices from various currencies to USD, using the provided conversion rates.
+    The rates are looked up for all rows at once; every currency without a rate is reported in a single ValueError.
     """
-    df['Price_in_USD'] = df.apply(lambda row: convert_to_usd(row, price_column, currency_column, conversion_rates), axis=1)
+    rates = df[currency_column].map(conversion_rates).astype('float64')
+    missing = rates.isna()
+    if missing.any():
+        unknown_currencies = sorted(df.loc[missing, currency_column].astype(str).unique())
+        raise ValueError(f"Conversion rates for currencies {', '.join(repr(c) for c in unknown_currencies)} are not available.")
+
+    df['Price_in_USD'] = df[price_column] * rates
     return df
 
 
@@ -200,7 +258,7 @@ def filter_by_country_variance(df, flight_id_col='Flight_ID', country_col='Detec
     - DataFrame filtered based on the specified country variance criterion.
     """
     # Count the number of different countries available per Flight_ID
-    country_count_per_flight = df.groupby(flight_id_col)[country_col].nunique().reset_index(name='FlightID_in_Countries_Count')
+    country_count_per_flight = df.groupby(flight_id_col, observed=True)[country_col].nunique().reset_index(name='FlightID_in_Countries_Count')
 
     # Merge this count back into the original DataFrame
     df = df.merge(country_count_per_flight, on=flight_id_col)
@@ -216,53 +274,202 @@ def extract_dates(df):
     df["arrival_date_day"] = df["arrival_date"].dt.strftime('%d-%m-%Y')
     return df
 
-def create_journey_id(df):
-    df["Journey_route"] = df["departure_airport_code"] + "-" + df["destination_airport_code"]
-    df["Journey_ID"] = df["Journey_route"] + ": " + df["departure_date_day"] + " " + df["arrival_date_day"]
+def create_journey_id(df, compact=False):
+    if not compact:
+        df["Journey_route"] = df["departure_airport_code"] + "-" + df["destination_airport_code"]
+        df["Journey_ID"] = df["Journey_route"] + ": " + df["departure_date_day"] + " " + df["arrival_date_day"]
+        return df
+
+    # Compact: the route is a categorical and the Journey_ID a 64-bit hash, missing where a date is missing
+    df["Journey_route"] = pd.Categorical(df["departure_airport_code"].astype(str) + "-" + df["destination_airport_code"].astype(str), ordered=True)
+    journey_columns = ["Journey_route", "departure_date_day", "arrival_date_day"]
+    journey_id = pd.Series(hash_columns(df, journey_columns), index=df.index, dtype='Int64')
+    df["Journey_ID"] = journey_id.mask(df[journey_columns].isna().any(axis=1))
+    return df
+
+
+def restore_readable_ids(df, flight_id_labels):
+    """
+    Replaces the compact Flight_ID and Journey_ID keys with the readable IDs of the default mode, for export.
+    Categorical columns need no conversion; they are written as their values.
+    """
+    df['Flight_ID'] = df['Flight_ID'].map(flight_id_labels)
+    df['Journey_ID'] = (df["Journey_route"].astype(str) + ": " + df["departure_date_day"] + " " + df["arrival_date_day"])
     return df
 
-def calculate_FlightID_price_stats(df):
-    price_stats = df.groupby('Flight_ID')['Price_in_USD'].agg(['max', 'min'])
-    price_stats['max_price_diff_FlightID'] = price_stats['max'] - price_stats['min']
-    price_stats.columns = ['max_price_FlightID', 'min_price_FlightID', 'max_price_diff_FlightID']
-    price_stats['max_rel_price_diff_FlightID'] = (price_stats['max_price_diff_FlightID'] / price_stats['min_price_FlightID']) * 100
-    df = pd.merge(df, price_stats, on='Flight_ID', how='left')
+class SortedGroupValues:
+    """
+    The values of one column sorted within their groups (NaN last, as np.sort does), sorted once
+    and shared by the order-statistic kernels. codes holds each row's group number, -1 for no group.
+    """
+
+    def __init__(self, codes, values, n_groups):
+        in_group = codes >= 0
+        codes, values = codes[in_group], values[in_group]
+        order = np.lexsort((values, codes))
+        self.codes = codes[order]
+        self.values = values[order]
+        self.n_groups = n_groups
+        self.counts = np.bincount(codes, minlength=n_groups)
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.rank = np.arange(len(self.codes)) - self.starts[self.codes]
+
+    def trim_mean(self, proportiontocut):
+        """
+        scipy.stats.trim_mean for every group: drops int(proportiontocut * n) values at each end
+        of the sorted group and averages the rest. A group containing NaN yields NaN, as scipy propagates it.
+        """
+        cut = (proportiontocut * self.counts).astype('int64')
+        keep = (self.rank >= cut[self.codes]) & (self.rank < (self.counts - cut)[self.codes])
+        sums = np.bincount(self.codes[keep], weights=self.values[keep], minlength=self.n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = sums / (self.counts - 2 * cut)
+        result[np.bincount(self.codes[np.isnan(self.values)], minlength=self.n_groups) > 0] = np.nan
+        return result
+
+    def median(self):
+        """Median of every group, ignoring NaN like groupby().median(); NaN for groups without values."""
+        valid_counts = np.bincount(self.codes[~np.isnan(self.values)], minlength=self.n_groups)
+        result = np.full(self.n_groups, np.nan)
+        has_values = valid_counts > 0
+        low = (self.starts + (valid_counts - 1) // 2)[has_values]
+        high = (self.starts + valid_counts // 2)[has_values]
+        result[has_values] = (self.values[low] + self.values[high]) / 2
+        return result
+
+
+TRIM_PROPORTION = 0.1
+
+# Aggregations computed from SortedGroupValues instead of groupby().agg()
+SORTED_AGGREGATIONS = {
+    'trimmed_mean': lambda sorted_values: sorted_values.trim_mean(TRIM_PROPORTION),
+    'median': lambda sorted_values: sorted_values.median(),
+}
+
+
+FLIGHT_KEY = ('Flight_ID',)
+JOURNEY_KEY = ('Journey_ID',)
+JOURNEY_COUNTRY_KEY = ('Journey_ID', 'Detected_Country')
+ROUTE_COUNTRY_KEY = ('Journey_route', 'Detected_Country')
+
+# Grouped features per grouping key: output column -> (source column, aggregation)
+GROUPED_FEATURES = {
+    FLIGHT_KEY: {
+        'max_price_FlightID': ('Price_in_USD', 'max'),
+        'min_price_FlightID': ('Price_in_USD', 'min'),
+    },
+    JOURNEY_KEY: {
+        'max_price_JourneyID': ('Price_in_USD', 'max'),
+        'min_price_JourneyID': ('Price_in_USD', 'min'),
+    },
+    JOURNEY_COUNTRY_KEY: {
+        'max_journey_same_country': ('Price_in_USD', 'max'),
+        'min_journey_same_country': ('Price_in_USD', 'min'),
+        'mean_savings_for_JourneyID_in_Detected_Country': ('rel_diff_to_min_price_FlightID', 'mean'),
+        'trimmed_mean_savings_for_JourneyID_in_Detected_Country': ('rel_diff_to_min_price_FlightID', 'trimmed_mean'),
+        'median_savings_for_JourneyID_country': ('rel_diff_to_min_price_FlightID', 'median'),
+    },
+    ROUTE_COUNTRY_KEY: {
+        'average_savings_for_Journey_route_in_Detected_Country': ('rel_diff_to_min_price_FlightID', 'mean'),
+        'mean_savings_for_Journey_route_in_Detected_Country': ('rel_diff_to_min_price_FlightID', 'mean'),
+        'trimmed_mean_savings_for_Journey_route_in_Detected_Country': ('rel_diff_to_min_price_FlightID', 'trimmed_mean'),
+        'median_savings_for_Journey_route_country': ('rel_diff_to_min_price_FlightID', 'median'),
+    },
+}
+
+
+class GroupedFeatureEngine:
+    """
+    Computes the requested aggregations of a grouping key in one groupby pass and broadcasts them to
+    the rows by group code instead of merging tables back. Order statistics (SORTED_AGGREGATIONS) come
+    from one within-group sort per source column. Nothing is kept between calls, as the pipeline steps
+    merge and replace the frame in between, so every call groups the rows it is given.
+    """
+
+    def __init__(self, features=GROUPED_FEATURES):
+        self.features = features
+
+    def _table(self, df, keys, columns):
+        grouped = df.groupby(list(keys), sort=False, observed=True)
+        # Rows with a missing key get code -1 and no features, as they did with left merges
+        codes = grouped.ngroup().fillna(-1).astype('int64').to_numpy()
+        n_groups = grouped.ngroups
+        # Identical (source, aggregation) pairs are computed once
+        unique_aggregations = {}
+        for column in columns:
+            unique_aggregations.setdefault(self.features[keys][column], f'aggregation_{len(unique_aggregations)}')
+
+        results = {}
+        pandas_aggregations = {name: spec for spec, name in unique_aggregations.items() if spec[1] not in SORTED_AGGREGATIONS}
+        if pandas_aggregations:
+            table = grouped.agg(**pandas_aggregations)
+            results.update({spec: table[name].to_numpy() for name, spec in pandas_aggregations.items()})
+
+        sorted_sources = {}
+        for source, aggregation in unique_aggregations:
+            if aggregation in SORTED_AGGREGATIONS:
+                if source not in sorted_sources:
+                    sorted_sources[source] = SortedGroupValues(codes, df[source].to_numpy(dtype='float64'), n_groups)
+                results[(source, aggregation)] = SORTED_AGGREGATIONS[aggregation](sorted_sources[source])
+
+        return codes, {column: results[self.features[keys][column]] for column in columns}
+
+    def broadcast(self, df, keys, columns):
+        """Adds the given grouped feature columns of `keys` to df, in the given order."""
+        codes, table = self._table(df, keys, columns)
+        for column in columns:
+            # The appended NaN is what code -1 picks
+            df[column] = np.append(table[column], np.nan)[codes]
+        return df
+
+
+def calculate_FlightID_price_stats(df, engine=None):
+    engine = engine or GroupedFeatureEngine()
+    df = engine.broadcast(df, FLIGHT_KEY, ['max_price_FlightID', 'min_price_FlightID'])
+    df['max_price_diff_FlightID'] = df['max_price_FlightID'] - df['min_price_FlightID']
+    df['max_rel_price_diff_FlightID'] = (df['max_price_diff_FlightID'] / df['min_price_FlightID']) * 100
+    return add_FlightID_price_differences(df)
+
+def add_FlightID_price_differences(df):
+    """Row-level part of calculate_FlightID_price_stats: the row's price against the flight's minimum."""
     df["abs_diff_to_min_price_FlightID"] = df["Price_in_USD"] - df["min_price_FlightID"]
     df["rel_diff_to_min_price_FlightID"] = ((df["Price_in_USD"] / df["min_price_FlightID"] ) -1) * 100
     df['rel_price_score_FlightID'] = df['rel_diff_to_min_price_FlightID'] / df['max_rel_price_diff_FlightID']
     return df
 
-def calculate_JourneyID_price_stats(df):    
-    price_stats_journey = df.groupby('Journey_ID')['Price_in_USD'].agg(['max', 'min'])
-    price_stats_journey['max_abs_diff_JourneyID'] = price_stats_journey['max'] - price_stats_journey['min']
-    price_stats_journey.columns = ['max_price_JourneyID', 'min_price_JourneyID', 'max_abs_diff_JourneyID']
-    price_stats_journey['max_rel_diff_Journey'] = (price_stats_journey['max_abs_diff_JourneyID'] / price_stats_journey['min_price_JourneyID']) * 100
-    df = pd.merge(df,price_stats_journey, on=['Journey_ID'], how='left')
+def calculate_JourneyID_price_stats(df, engine=None):
+    engine = engine or GroupedFeatureEngine()
+    df = engine.broadcast(df, JOURNEY_KEY, ['max_price_JourneyID', 'min_price_JourneyID'])
+    df['max_abs_diff_JourneyID'] = df['max_price_JourneyID'] - df['min_price_JourneyID']
+    df['max_rel_diff_Journey'] = (df['max_abs_diff_JourneyID'] / df['min_price_JourneyID']) * 100
+    return add_JourneyID_price_differences(df)
+
+def add_JourneyID_price_differences(df):
+    """Row-level part of calculate_JourneyID_price_stats: the row's price against the journey's minimum."""
     df["abs_diff_to_min_price_JourneyID"] = df["Price_in_USD"] - df["min_price_JourneyID"]
     df["rel_diff_to_min_price_JourneyID"] = ((df["Price_in_USD"] /df["min_price_JourneyID"] ) -1) * 100
     df['rel_price_score_JourneyID'] = df['rel_diff_to_min_price_JourneyID'] / df['max_rel_diff_Journey']
     return df
 
 
-def calculate_price_stats_for_JourneyID_same_country(df):
+def calculate_price_stats_for_JourneyID_same_country(df, engine=None):
     """
     Calculate price statistics for identical journey IDs within the same query country.
 
     Parameters:
     - df: DataFrame containing the dataset.
+    - engine: GroupedFeatureEngine shared by the pipeline steps (a new one if omitted).
 
     Returns:
     - DataFrame with additional columns for price statistics.
     """
-    price_stats_journey_same_country = df.groupby(['Journey_ID', 'Detected_Country'])['Price_in_USD'].agg(['max', 'min'])
-    price_stats_journey_same_country['max_abs_diff_perIDGroup_Journey_same_country'] = price_stats_journey_same_country['max'] - price_stats_journey_same_country['min']
-    price_stats_journey_same_country.columns = ['max_journey_same_country', 'min_journey_same_country', 'max_abs_diff_perIDGroup_Journey_same_country']
-    price_stats_journey_same_country['max_rel_diff_perIDGroup_Journey_same_country'] = (price_stats_journey_same_country['max_abs_diff_perIDGroup_Journey_same_country'] / price_stats_journey_same_country['min_journey_same_country']) * 100
-
-    df = pd.merge(df, price_stats_journey_same_country, on=['Journey_ID','Detected_Country'], how='left')
+    engine = engine or GroupedFeatureEngine()
+    df = engine.broadcast(df, JOURNEY_COUNTRY_KEY, ['max_journey_same_country', 'min_journey_same_country'])
+    df['max_abs_diff_perIDGroup_Journey_same_country'] = df['max_journey_same_country'] - df['min_journey_same_country']
+    df['max_rel_diff_perIDGroup_Journey_same_country'] = (df['max_abs_diff_perIDGroup_Journey_same_country'] / df['min_journey_same_country']) * 100
     df["price_diff_loc_to_glob_Journey_min"] = df["min_journey_same_country"] - df["min_price_JourneyID"]
     df["rel_price_diff_loc_to_glob_Journey_min"] = (df["price_diff_loc_to_glob_Journey_min"] / df["min_price_JourneyID"]) * 100
-    
+
     return df
 
 
@@ -270,7 +477,7 @@ def calculate_price_stats_for_JourneyID_same_country(df):
 def identify_cheapest_location_JourneyID(df):
     cheapest_mask = df['Price_in_USD'] == df['min_price_JourneyID']
     cheapest_journeys = df[cheapest_mask]
-    cheapest_locations = cheapest_journeys.groupby('Journey_ID')['Detected_Country'].min().reset_index(name='Cheapest_Location_Journey')
+    cheapest_locations = cheapest_journeys.groupby('Journey_ID', observed=True)['Detected_Country'].min().reset_index(name='Cheapest_Location_Journey')
     return df.merge(cheapest_locations, on='Journey_ID', how='left')
 
 def identify_cheapest_location_FlightID(df):
@@ -282,7 +489,7 @@ def identify_cheapest_location_FlightID(df):
     filtered_df = df[df['Flight_ID'].isin(flights_with_high_diff)]
     cheapest_mask = filtered_df['Price_in_USD'] == filtered_df['min_price_FlightID']
     cheapest_flights = filtered_df[cheapest_mask]
-    cheapest_locations = cheapest_flights.groupby('Flight_ID')['Detected_Country'].min().reset_index(name='Cheapest_Location_Flight_temp')
+    cheapest_locations = cheapest_flights.groupby('Flight_ID', observed=True)['Detected_Country'].min().reset_index(name='Cheapest_Location_Flight_temp')
 
     # Merge the original df with the cheapest locations using a temporary column to avoid overwriting the None values
     updated_df = df.merge(cheapest_locations, on='Flight_ID', how='left')
@@ -296,101 +503,453 @@ def identify_cheapest_location_FlightID(df):
 
 
 
-def calculate_average_savings_Journey_route(df):
-    average_savings = df.groupby(['Journey_route', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].mean().reset_index(name='average_savings_for_Journey_route_in_Detected_Country')
-    return df.merge(average_savings, on=['Journey_route', 'Detected_Country'], how='left')
+def calculate_average_savings_Journey_route(df, engine=None):
+    engine = engine or GroupedFeatureEngine()
+    return engine.broadcast(df, ROUTE_COUNTRY_KEY, ['average_savings_for_Journey_route_in_Detected_Country'])
 
-def determine_mode_cheapest_location(df):
-    cheapest_location_counts = df.groupby(['Journey_route', 'Detected_Country', 'Cheapest_Location_Flight']).size().reset_index(name='count_cheapest_location')
-    cheapest_location_counts = cheapest_location_counts.sample(frac=1).reset_index(drop=True)
-    sorted_counts = cheapest_location_counts.sort_values(['Journey_route', 'Detected_Country', 'count_cheapest_location'], ascending=[True, True, False])
-    top_cheapest_location = sorted_counts.groupby(['Journey_route', 'Detected_Country']).first().reset_index()
-    top_cheapest_location["Mode_Cheapest_Location_Journey"] = top_cheapest_location["Cheapest_Location_Flight"]
-    return df.merge(top_cheapest_location[['Journey_route', 'Detected_Country', 'Mode_Cheapest_Location_Journey']], on=['Journey_route', 'Detected_Country'], how='left')
+# Journey_ID is a string, or a hash in compact and chunked mode; the route is the same text in every mode,
+# so mode ties are broken on route and country and come out the same in all of them
+MODE_TIE_BREAK_COLUMNS = ['Journey_route', 'Detected_Country']
 
-def determine_mode_cheapest_location_JourneyID(df):
-    cheapest_location_counts = df.groupby(['Journey_ID', 'Detected_Country', 'Cheapest_Location_Flight']).size().reset_index(name='count_cheapest_location')
-    cheapest_location_counts = cheapest_location_counts.sample(frac=1).reset_index(drop=True)
-    sorted_counts = cheapest_location_counts.sort_values(['Journey_ID', 'Detected_Country', 'count_cheapest_location'], ascending=[True, True, False])
-    top_cheapest_location = sorted_counts.groupby(['Journey_ID', 'Detected_Country']).first().reset_index()
-    top_cheapest_location["Mode_Cheapest_Location_JourneyID"] = top_cheapest_location["Cheapest_Location_Flight"]
-    return df.merge(top_cheapest_location[['Journey_ID', 'Detected_Country', 'Mode_Cheapest_Location_JourneyID']], on=['Journey_ID', 'Detected_Country'], how='left')
 
+def grouped_mode(df, keys, value_column, seed=0, tie_break_columns=None):
+    """
+    Most frequent value of `value_column` per group of `keys`, as a DataFrame of the keys and the value.
+    Values are counted in one groupby, and each count gets a priority in [0, 1) from a hash of the seed,
+    `tie_break_columns` (default: keys) and the value; the highest score wins. Ties thus go the same way
+    for any row order and the same seed, and differently between seeds.
+    """
+    keys = list(keys)
+    tie_break_columns = list(tie_break_columns or keys)
+    group_columns = list(dict.fromkeys(keys + tie_break_columns)) + [value_column]
+    counts = df.groupby(group_columns, observed=True, sort=False).size().reset_index(name='count')
 
+    hashes = pd.util.hash_pandas_object(counts[tie_break_columns + [value_column]].assign(mode_seed=seed), index=False).to_numpy()
+    # The top 53 bits of the hash as a fraction, which stays below the step between two counts
+    counts['score'] = counts['count'] + (hashes >> np.uint64(11)) / 2.0**53
+    winners = counts.groupby(keys, observed=True, sort=False)['score'].idxmax()
+    return counts.loc[winners, keys + [value_column]]
 
-def calculate_savings_metrics(df):
-    # Mean Savings for JourneyID
-    mean_savings_journeyID = df.groupby(['Journey_ID', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].mean().reset_index(name='mean_savings_for_JourneyID_in_Detected_Country')
-    df = df.merge(mean_savings_journeyID, on=['Journey_ID', 'Detected_Country'], how='left')
 
-    # Trimmed Mean Savings for JourneyID
-    trimmed_savings_journeyID = df.groupby(['Journey_ID', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].apply(lambda x: trim_mean(x, proportiontocut=0.1)).reset_index(name='trimmed_mean_savings_for_JourneyID_in_Detected_Country')
-    df = df.merge(trimmed_savings_journeyID, on=['Journey_ID', 'Detected_Country'], how='left')
+def determine_mode_cheapest_location(df, seed=0):
+    keys = ['Journey_route', 'Detected_Country']
+    top_cheapest_location = grouped_mode(df, keys, 'Cheapest_Location_Flight', seed, MODE_TIE_BREAK_COLUMNS)
+    top_cheapest_location = top_cheapest_location.rename(columns={'Cheapest_Location_Flight': 'Mode_Cheapest_Location_Journey'})
+    return df.merge(top_cheapest_location, on=keys, how='left')
+
+def determine_mode_cheapest_location_JourneyID(df, seed=0):
+    keys = ['Journey_ID', 'Detected_Country']
+    top_cheapest_location = grouped_mode(df, keys, 'Cheapest_Location_Flight', seed, MODE_TIE_BREAK_COLUMNS)
+    top_cheapest_location = top_cheapest_location.rename(columns={'Cheapest_Location_Flight': 'Mode_Cheapest_Location_JourneyID'})
+    return df.merge(top_cheapest_location, on=keys, how='left')
+
 
-    # Log of Mean Savings for JourneyID
-    df['log_mean_savings_for_JourneyID_in_Detected_Country'] = np.log(df['mean_savings_for_JourneyID_in_Detected_Country'] + 1)
 
-    # Mean Savings for JourneyRoute
-    mean_savings_journey_route = df.groupby(['Journey_route', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].mean().reset_index(name='mean_savings_for_Journey_route_in_Detected_Country')
-    df = df.merge(mean_savings_journey_route, on=['Journey_route', 'Detected_Country'], how='left')
+def calculate_savings_metrics(df, engine=None):
+    engine = engine or GroupedFeatureEngine()
 
-    # Trimmed Mean Savings for JourneyRoute
-    trimmed_savings_journey_route = df.groupby(['Journey_route', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].apply(lambda x: trim_mean(x, proportiontocut=0.1)).reset_index(name='trimmed_mean_savings_for_Journey_route_in_Detected_Country')
-    df = df.merge(trimmed_savings_journey_route, on=['Journey_route', 'Detected_Country'], how='left')
+    # Mean and trimmed mean savings for JourneyID, and the log of the mean
+    df = engine.broadcast(df, JOURNEY_COUNTRY_KEY, ['mean_savings_for_JourneyID_in_Detected_Country',
+                                                    'trimmed_mean_savings_for_JourneyID_in_Detected_Country'])
+    df['log_mean_savings_for_JourneyID_in_Detected_Country'] = np.log(df['mean_savings_for_JourneyID_in_Detected_Country'] + 1)
 
-    # Log of Trimmed Mean Savings for JourneyRoute
+    # Mean and trimmed mean savings for JourneyRoute, and the log of the trimmed mean
+    df = engine.broadcast(df, ROUTE_COUNTRY_KEY, ['mean_savings_for_Journey_route_in_Detected_Country',
+                                                  'trimmed_mean_savings_for_Journey_route_in_Detected_Country'])
     df['log_mean_savings_for_Journey_route_in_Detected_Country'] = np.log(df['trimmed_mean_savings_for_Journey_route_in_Detected_Country'] + 1)
 
-    # Median Savings for JourneyRoute
-    median_savings_journey_route = df.groupby(['Journey_route', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].median().reset_index(name='median_savings_for_Journey_route_country')
-    df = df.merge(median_savings_journey_route, on=['Journey_route', 'Detected_Country'], how='left')
+    # Median savings for JourneyRoute and JourneyID
+    df = engine.broadcast(df, ROUTE_COUNTRY_KEY, ['median_savings_for_Journey_route_country'])
+    df = engine.broadcast(df, JOURNEY_COUNTRY_KEY, ['median_savings_for_JourneyID_country'])
 
-    # Median Savings for JourneyRoute
-    median_savings_JourneyID = df.groupby(['Journey_ID', 'Detected_Country'])['rel_diff_to_min_price_FlightID'].median().reset_index(name='median_savings_for_JourneyID_country')
-    df = df.merge(median_savings_JourneyID, on=['Journey_ID', 'Detected_Country'], how='left')
+    return add_normalized_mean_savings(df)
 
-    # Normalized Mean Savings
+def add_normalized_mean_savings(df):
+    """Normalized Mean Savings: mean of the journey's mean and the route's median savings, whichever exist."""
     df['normalized_mean_savings'] = df[['mean_savings_for_JourneyID_in_Detected_Country', 'median_savings_for_Journey_route_country']].mean(axis=1)
     
     return df
 
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Preprocess dataset with configuration.')
-    parser.add_argument('filename', help='The name of the file to be loaded')
-    args = parser.parse_args()
+RAW_DATA_DIRECTORY = '../data/3.raw_query_results'
 
-    conversion_rates, query_date = load_initial_configuration(args.filename)
+# Flights queried from fewer countries are dropped before the group features
+MIN_QUERY_COUNTRIES = 7
+
+
+def preprocess_query_file(filename, compact=False):
+    """
+    Runs the per-file stages on one query file: IDs, dates, cleaning, conversion with the file's own
+    rates and the days until departure from its own query date.
+    Returns (df, flight_id_labels); the labels are None unless compact.
+    """
+    conversion_rates, query_date = load_initial_configuration(filename)
 
     # Proceed with data loading, cleaning, feature engineering, and exporting...
     #get path to data
-    df_path = get_absolute_path(f'../data/3.raw_query_results/{args.filename}')
+    df_path = get_absolute_path(f'{RAW_DATA_DIRECTORY}/{filename}')
     df = load_dataset(df_path)
 
     # Feature Engineering 
-    df = create_flight_id(df)
+    flight_id_labels = None
+    if compact:
+        df = convert_to_compact_dtypes(df)
+        df, flight_id_labels = create_compact_flight_id(df)
+    else:
+        df = create_flight_id(df)
     df = convert_date_columns(df)
-    df = remove_duplicates_and_erroneous_rows(df)
+    df = remove_duplicates_and_erroneous_rows(df, compact=compact)
     df = convert_prices_to_usd(df, 'ticket_price', 'Detected_Currency', conversion_rates)
     df = calculate_commute_time(df, 'arrival_date', 'departure_date')
     df = set_query_date_and_calculate_days_until_departure(df, 'departure_date', query_date)
-    df = filter_by_country_variance(df,min_countries=7)
+    return df, flight_id_labels
+
+
+def add_group_features(df, compact=False, seed=0):
+    """
+    Runs the stages that compare rows across query countries (and, in batch mode, across query files).
+    `seed` breaks ties between equally frequent cheapest locations.
+    """
+    df = filter_by_country_variance(df, min_countries=MIN_QUERY_COUNTRIES)
     df = extract_dates(df)
-    df = create_journey_id(df)
-    df = calculate_FlightID_price_stats(df)
-    df = calculate_JourneyID_price_stats(df)
+    df = create_journey_id(df, compact=compact)
+    return calculate_group_features(df, seed=seed)
+
+
+def calculate_group_features(df, seed=0):
+    """
+    Adds the flight, journey and route features to rows that already have Flight_ID, Journey_ID,
+    Journey_route, Detected_Country and Price_in_USD.
+    """
+    engine = GroupedFeatureEngine()
+    df = calculate_FlightID_price_stats(df, engine)
+    df = calculate_JourneyID_price_stats(df, engine)
     df = identify_cheapest_location_FlightID(df)
     df = identify_cheapest_location_JourneyID(df)
-    df = calculate_price_stats_for_JourneyID_same_country(df)
-    df = calculate_average_savings_Journey_route(df)
-    df = determine_mode_cheapest_location(df)
-    df = determine_mode_cheapest_location_JourneyID(df)
-    df = calculate_savings_metrics(df)
+    df = calculate_price_stats_for_JourneyID_same_country(df, engine)
+    df = calculate_average_savings_Journey_route(df, engine)
+    df = determine_mode_cheapest_location(df, seed=seed)
+    df = determine_mode_cheapest_location_JourneyID(df, seed=seed)
+    df = calculate_savings_metrics(df, engine)
+    return df
+
+
+def preprocess_batch(filenames, compact=False, workers=None, seed=0):
+    """
+    Runs the per-file stages of several query files in a process pool, each with its own conversion rates
+    and query date, then computes the group features over the combined data.
+    Returns (df, flight_id_labels) like preprocess_query_file.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(preprocess_query_file, filenames, [compact] * len(filenames)))
+
+    df = pd.concat([file_df for file_df, _ in results], ignore_index=True)
+    flight_id_labels = None
+    if compact:
+        # Files have different category sets, which concat turns into object columns
+        df = convert_to_compact_dtypes(df)
+        flight_id_labels = pd.concat([labels for _, labels in results])
+        flight_id_labels = flight_id_labels[~flight_id_labels.index.duplicated()]
+    return add_group_features(df, compact=compact, seed=seed), flight_id_labels
+
+
+# Text columns read as strings in the chunked mode, so a chunk without values in one of them
+# hashes and joins like the others
+CHUNK_TEXT_COLUMNS = FLIGHT_ID_COLUMNS + ['Detected_Language', 'Detected_Country', 'Detected_Currency']
+
+# Features of the chunked mode that are constant within a grouping key, joined to the rows of each chunk.
+# The remaining features depend on the row's own price and are recomputed per chunk.
+CHUNKED_GROUP_COLUMNS = {
+    FLIGHT_KEY: ['max_price_FlightID', 'min_price_FlightID', 'max_price_diff_FlightID', 'max_rel_price_diff_FlightID',
+                 'Cheapest_Location_Flight'],
+    JOURNEY_KEY: ['max_price_JourneyID', 'min_price_JourneyID', 'max_abs_diff_JourneyID', 'max_rel_diff_Journey',
+                  'Cheapest_Location_Journey'],
+    JOURNEY_COUNTRY_KEY: ['max_journey_same_country', 'min_journey_same_country',
+                          'max_abs_diff_perIDGroup_Journey_same_country', 'max_rel_diff_perIDGroup_Journey_same_country',
+                          'price_diff_loc_to_glob_Journey_min', 'rel_price_diff_loc_to_glob_Journey_min',
+                          'Mode_Cheapest_Location_JourneyID', 'mean_savings_for_JourneyID_in_Detected_Country',
+                          'trimmed_mean_savings_for_JourneyID_in_Detected_Country',
+                          'log_mean_savings_for_JourneyID_in_Detected_Country', 'median_savings_for_JourneyID_country'],
+    ROUTE_COUNTRY_KEY: ['average_savings_for_Journey_route_in_Detected_Country', 'Mode_Cheapest_Location_Journey',
+                        'mean_savings_for_Journey_route_in_Detected_Country',
+                        'trimmed_mean_savings_for_Journey_route_in_Detected_Country',
+                        'log_mean_savings_for_Journey_route_in_Detected_Country', 'median_savings_for_Journey_route_country'],
+}
+
+# The readable IDs of a chunk are joined through their hashes, kept in these columns
+CHUNK_KEY_COLUMNS = {'Flight_ID': 'Flight_key', 'Journey_ID': 'Journey_key'}
+
+
+class CategoryCodes:
+    """
+    Integer codes for the values of a text column that stay the same across chunks, -1 for missing values.
+    categorical() turns collected codes into an ordered Categorical, as compact mode uses.
+    """
+
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, series):
+        for value in series.dropna().unique():
+            self.codes.setdefault(value, len(self.codes))
+        return series.map(self.codes).fillna(-1).astype('int64').to_numpy()
+
+    def categorical(self, codes):
+        categories = sorted(self.codes)
+        # Position of every code in the sorted categories; the trailing -1 is what code -1 picks
+        positions = np.full(len(categories) + 1, -1, dtype='int64')
+        positions[[self.codes[value] for value in categories]] = np.arange(len(categories))
+        return pd.Categorical.from_codes(positions[codes], categories=categories, ordered=True)
+
+
+def hash_journey_key(df):
+    """
+    64-bit hash standing in for the readable Journey_ID (route, departure day and arrival day) of every row,
+    missing where the readable ID would be. Works on the datetime64 date columns, before extract_dates.
+    """
+    parts = pd.DataFrame({
+        'route': df["departure_airport_code"] + "-" + df["destination_airport_code"],
+        'departure_day': df['departure_date'].dt.normalize(),
+        'arrival_day': df['arrival_date'].dt.normalize(),
+    })
+    journey_key = pd.Series(hash_columns(parts, list(parts.columns)), index=df.index, dtype='Int64')
+    return journey_key.mask(parts.isna().any(axis=1))
+
+
+def has_time_of_day(dates):
+    """True for the datetime64 values that are not at midnight; NaT counts as midnight."""
+    return (dates - dates.dt.normalize()) > pd.Timedelta(0)
+
+
+def iter_query_chunks(filenames, chunksize, dtype=None):
+    """
+    Yields (file_index, chunk, conversion_rates, query_date) for chunks of at most `chunksize` rows
+    of the query files, in order.
+    """
+    for file_index, filename in enumerate(filenames):
+        conversion_rates, query_date = load_initial_configuration(filename)
+        df_path = get_absolute_path(f'{RAW_DATA_DIRECTORY}/{filename}')
+        if not os.path.exists(df_path):
+            print(f"The file {df_path} was not found.")
+            exit(1)
+        read_dtypes = dtype or {col: str for col in CHUNK_TEXT_COLUMNS}
+        for chunk in pd.read_csv(df_path, chunksize=chunksize, dtype=read_dtypes):
+            yield file_index, chunk, conversion_rates, query_date
+
+
+def unify_read_dtypes(chunk_dtypes):
+    """
+    Read dtypes for the second pass. Numeric columns that were read as floats in some chunk (because of
+    missing values) are read as floats in all of them, as a read of the whole file would do.
+    """
+    read_dtypes = {col: str for col in CHUNK_TEXT_COLUMNS}
+    for col in chunk_dtypes[0].index:
+        kinds = {dtypes[col].kind for dtypes in chunk_dtypes}
+        if 'f' in kinds and kinds <= {'i', 'u', 'f'}:
+            read_dtypes[col] = 'float64'
+    return read_dtypes
+
+
+def scan_query_chunks(filenames, chunksize):
+    """
+    First pass of the chunked mode. Streams the query files and keeps per row only what the group features
+    need: hashed Flight_ID and Journey_ID, route, country and price in USD.
+    Returns (narrow, keep, read_dtypes): the narrow rows left after deduplication and cleaning, a mask over
+    all raw rows marking those rows, and the dtypes for reading the files again.
+    """
+    duplicate_keys, file_indices, valid_masks, parts, chunk_dtypes = [], [], [], [], []
+    routes, countries = CategoryCodes(), CategoryCodes()
+    for file_index, chunk, conversion_rates, _ in iter_query_chunks(filenames, chunksize):
+        chunk_dtypes.append(chunk.dtypes)
+        chunk['Flight_ID'] = hash_columns(chunk, FLIGHT_ID_COLUMNS)
+        duplicate_keys.append(hash_duplicate_key(chunk))
+        file_indices.append(np.full(len(chunk), file_index, dtype='int32'))
+        # The row filters of remove_duplicates_and_erroneous_rows
+        valid = (chunk[['Detected_Currency', 'ticket_price', 'Detected_Country']].notna().all(axis=1)
+                 & (chunk['ticket_price'] >= 10)).to_numpy()
+        valid_masks.append(valid)
+        if not valid.any():
+            # Only the duplicate keys count for this chunk; the stages below need at least one row
+            continue
+
+        rows = convert_date_columns(chunk[valid].copy())
+        rows = convert_prices_to_usd(rows, 'ticket_price', 'Detected_Currency', conversion_rates)
+        parts.append(pd.DataFrame({
+            'Flight_ID': rows['Flight_ID'].to_numpy(),
+            'Journey_ID': hash_journey_key(rows).to_numpy(),
+            'Journey_route': routes.encode(rows["departure_airport_code"] + "-" + rows["destination_airport_code"]),
+            'Detected_Country': countries.encode(rows['Detected_Country']),
+            'Price_in_USD': rows['Price_in_USD'].to_numpy(),
+            'departure_date_missing': rows['departure_date'].isna().to_numpy(),
+            **{f'{col}_has_time': has_time_of_day(rows[col]).to_numpy() for col in ['departure_date', 'arrival_date']},
+        }))
+
+    # Duplicates are dropped within each file, keeping the first, before the row filters as in the per-file stages
+    duplicates = pd.DataFrame({'file': np.concatenate(file_indices), 'key': np.concatenate(duplicate_keys)}).duplicated().to_numpy()
+    valid = np.concatenate(valid_masks)
+    narrow = pd.concat(parts, ignore_index=True)[~duplicates[valid]].reset_index(drop=True)
+    narrow['Journey_route'] = routes.categorical(narrow['Journey_route'].to_numpy())
+    narrow['Detected_Country'] = countries.categorical(narrow['Detected_Country'].to_numpy())
+    return narrow, valid & ~duplicates, unify_read_dtypes(chunk_dtypes)
+
+
+def build_chunked_feature_tables(narrow, seed=0):
+    """
+    Computes the group features on the narrow rows of scan_query_chunks and reduces them to one table per
+    grouping key (CHUNKED_GROUP_COLUMNS), keyed like the chunks of the second pass.
+    Returns (country_counts, tables, feature_columns): FlightID_in_Countries_Count of every flight that passes
+    the country filter, the tables, and all feature columns in the order add_group_features adds them.
+    """
+    narrow = filter_by_country_variance(narrow, min_countries=MIN_QUERY_COUNTRIES)
+    base_columns = list(narrow.columns)
+    narrow = calculate_group_features(narrow, seed=seed)
+    feature_columns = [col for col in narrow.columns if col not in base_columns]
+
+    flights = narrow.drop_duplicates(subset='Flight_ID')
+    country_counts = pd.Series(flights['FlightID_in_Countries_Count'].to_numpy(), index=flights['Flight_ID'].to_numpy())
+    tables = {}
+    for keys, columns in CHUNKED_GROUP_COLUMNS.items():
+        table = narrow.drop_duplicates(subset=list(keys))
+        table = table.loc[table[list(keys)].notna().all(axis=1), list(keys) + columns]
+        # Route and country are joined to the text columns of the chunks
+        for key in ['Journey_route', 'Detected_Country']:
+            if key in keys:
+                table[key] = table[key].astype(object)
+        tables[keys] = table.rename(columns=CHUNK_KEY_COLUMNS)
+    return country_counts, tables, feature_columns
+
+
+def write_query_chunks(filenames, chunksize, output_path, keep, read_dtypes, days_as_float, timed_date_columns,
+                       country_counts, tables, feature_columns):
+    """
+    Second pass of the chunked mode. Streams the query files again, runs the per-file stages on the rows kept
+    by the first pass, joins the feature tables and appends every chunk to the output CSV.
+    to_csv leaves out the time of a datetime column that is all midnight, so the date columns are formatted
+    here, with a time only if they are in `timed_date_columns`, as a write of all rows at once would do.
+    """
+    offset = 0
+    header = True
+    with open(output_path, 'w', newline='') as output:
+        for _, chunk, conversion_rates, query_date in iter_query_chunks(filenames, chunksize, read_dtypes):
+            chunk_keep = keep[offset:offset + len(chunk)]
+            offset += len(chunk)
+            if not chunk_keep.any():
+                continue
+            chunk['Flight_key'] = hash_columns(chunk, FLIGHT_ID_COLUMNS)
+            df = create_flight_id(chunk[chunk_keep].copy())
+            df = convert_date_columns(df)
+            df = convert_prices_to_usd(df, 'ticket_price', 'Detected_Currency', conversion_rates)
+            df = calculate_commute_time(df, 'arrival_date', 'departure_date')
+            df = set_query_date_and_calculate_days_until_departure(df, 'departure_date', query_date)
+            if days_as_float:
+                # A missing departure date anywhere in the data makes the whole column float
+                df['days_until_departure'] = df['days_until_departure'].astype('float64')
+
+            # filter_by_country_variance, with the country counts of all chunks
+            df = df[df['Flight_key'].isin(country_counts.index)]
+            if df.empty:
+                continue
+            df['FlightID_in_Countries_Count'] = df['Flight_key'].map(country_counts)
+            df = extract_dates(df)
+            df = create_journey_id(df)
+            df['Journey_key'] = hash_journey_key(df)
+            base_columns = [col for col in df.columns if col not in CHUNK_KEY_COLUMNS.values()]
+
+            for keys, table in tables.items():
+                df = df.merge(table, on=[CHUNK_KEY_COLUMNS.get(key, key) for key in keys], how='left')
+            df = add_FlightID_price_differences(df)
+            df = add_JourneyID_price_differences(df)
+            df = add_normalized_mean_savings(df)
+
+            for col in ['departure_date', 'arrival_date', 'query_date']:
+                df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S' if col in timed_date_columns else '%Y-%m-%d')
+            df[base_columns + feature_columns].to_csv(output, header=header, index=False)
+            header = False
+
+
+def preprocess_chunked(filenames, chunksize, output_path, seed=0):
+    """
+    Out-of-core variant of the per-file stages plus add_group_features, in two passes over the query files
+    with at most `chunksize` raw rows in memory at a time. Rows are written in file order.
+    """
+    narrow, keep, read_dtypes = scan_query_chunks(filenames, chunksize)
+    days_as_float = narrow.pop('departure_date_missing').any()
+    time_flags = narrow[['departure_date_has_time', 'arrival_date_has_time']]
+    narrow = narrow.drop(columns=time_flags.columns)
+    print(f"First pass: {keep.size} rows read, {len(narrow)} left after deduplication and cleaning")
+    country_counts, tables, feature_columns = build_chunked_feature_tables(narrow, seed=seed)
+
+    # Date columns with a time of day in any written row (those of flights passing the country filter)
+    written = narrow['Flight_ID'].isin(country_counts.index).to_numpy()
+    timed_date_columns = {col for col in ['departure_date', 'arrival_date'] if time_flags.loc[written, f'{col}_has_time'].any()}
+    # Parsed one by one like add_query_date does, as the configured dates may mix formats
+    query_dates = pd.to_datetime(pd.Series([pd.to_datetime(load_config(filename).get("query_date")) for filename in filenames]))
+    if has_time_of_day(query_dates).any():
+        timed_date_columns.add('query_date')
+    del narrow, time_flags
+    write_query_chunks(filenames, chunksize, output_path, keep, read_dtypes, days_as_float, timed_date_columns,
+                       country_counts, tables, feature_columns)
+
+
+def resolve_batch_filenames(args):
+    """
+    Returns the query files of a batch run: every configured file with --all_configured, or the
+    files in the raw data directory matching --glob. Exits if a file has no configuration entry.
+    """
+    configured = load_configured_filenames()
+    if args.all_configured:
+        return configured
+
+    raw_directory = get_absolute_path(RAW_DATA_DIRECTORY)
+    filenames = sorted(os.path.basename(path) for path in glob.glob(os.path.join(raw_directory, args.glob)))
+    unconfigured = [filename for filename in filenames if filename not in configured]
+    if unconfigured:
+        print(f"No conversion rates and query date configured for: {', '.join(unconfigured)}")
+        exit(1)
+    if not filenames:
+        print(f"No query files match {args.glob} in {raw_directory}.")
+        exit(1)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Preprocess dataset with configuration.')
+    parser.add_argument('filename', nargs='?', help='The name of the file to be loaded')
+    parser.add_argument('--compact', action='store_true', help='Use integer keys and categorical columns while processing; the export is unchanged')
+    parser.add_argument('--all_configured', action='store_true', help='Batch mode: process every file listed in preproccessing_config.json')
+    parser.add_argument('--glob', help='Batch mode: process the configured files in the raw data directory matching this pattern, e.g. "Query_15*.csv"')
+    parser.add_argument('--workers', type=int, default=None, help='Processes for the per-file stages in batch mode (default: one per core)')
+    parser.add_argument('--output', default='Processed_batch.csv', help='Output file name in batch mode (default: Processed_batch.csv)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for breaking ties in the Mode_Cheapest_Location features (default: 0)')
+    parser.add_argument('--chunksize', type=int, default=None, help='Process the query files out of core in two passes over chunks of this many rows')
+    args = parser.parse_args()
 
+    batch = bool(args.all_configured or args.glob)
+    if batch:
+        filenames = resolve_batch_filenames(args)
+        print(f"Preprocessing {len(filenames)} files: {', '.join(filenames)}")
+        output_name = args.output
+    elif args.filename:
+        filenames = [args.filename]
+        output_name = f'Processed_{args.filename}'
+    else:
+        parser.error('give a filename, --all_configured or --glob')
+    Output_path = get_absolute_path(f'../data/4.processed_data/{output_name}')
+
+    if args.chunksize:
+        preprocess_chunked(filenames, args.chunksize, Output_path, seed=args.seed)
+        return
+
+    if batch:
+        df, flight_id_labels = preprocess_batch(filenames, compact=args.compact, workers=args.workers, seed=args.seed)
+    else:
+        df, flight_id_labels = preprocess_query_file(args.filename, compact=args.compact)
+        df = add_group_features(df, compact=args.compact, seed=args.seed)
 
     # Export data
-    Output_path = get_absolute_path(f'../data/4.processed_data/Processed_{args.filename}')
+    if args.compact:
+        df = restore_readable_ids(df, flight_id_labels)
     df.to_csv(Output_path, index=False)
 
 if __name__ == "__main__":